@@ -1,15 +1,27 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, session
+import click
+import orjson
+import redis
+from contextlib import contextmanager
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask.json.provider import DefaultJSONProvider
 from config import Config
+from werkzeug.exceptions import HTTPException
 from werkzeug.middleware.proxy_fix import ProxyFix
 from models import db, Product, Transaction, User, UserRole
-from models import TransactionStatus
+from models import TransactionStatus, DailySales, ProductDailySales
 from flask_login import LoginManager, login_required, current_user
 from flask_wtf.csrf import CSRFProtect
 from data_initialization import initialize_sample_data
-from datetime import datetime
-from sqlalchemy import desc, func, inspect
+from datetime import datetime, timedelta
+from sqlalchemy import desc, func, inspect, text
 from services.cache_service import init_cache
+from services.analytics_service import AnalyticsService
+from utils.language import get_language, get_text, translate_name
+from utils.helpers import password_has_required_characters, flush_pending_logs
+
+# Arbitrary application-wide key for pg_advisory_lock around startup initialization
+DB_INIT_LOCK_KEY = 4242
 
 
 def create_default_admin_user():
@@ -30,11 +42,7 @@ def create_default_admin_user():
             raise RuntimeError("Admin password must be at least 8 characters for security")
         
         # Additional password complexity check (same as user registration)
-        has_upper = any(c.isupper() for c in admin_password)
-        has_lower = any(c.islower() for c in admin_password)
-        has_digit = any(c.isdigit() for c in admin_password)
-        
-        if not (has_upper and has_lower and has_digit):
+        if not password_has_required_characters(admin_password):
             print("❌ SECURITY ERROR: ADMIN_PASSWORD must contain uppercase letters, lowercase letters, and numbers")
             print("   Example: MySecureP@ssw0rd123")
             raise RuntimeError("Admin password must contain uppercase, lowercase, and numbers for security")
@@ -56,15 +64,24 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
     
+    # The flask command sets this before loading the app for any CLI command
+    running_flask_cli = os.environ.get('FLASK_RUN_FROM_CLI') == 'true'
+    
     # Add ProxyFix for Replit environment
     app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
     
+    # Serialize JSON responses with orjson
+    init_json_provider(app)
+    
     # Initialize extensions
     db.init_app(app)
     
     # Initialize caching
     cache = init_cache(app)
     
+    # Session data (current transaction etc.) lives in the store chosen by SESSION_TYPE
+    init_session_store(app)
+    
     # Initialize CSRF protection
     csrf = CSRFProtect()
     csrf.init_app(app)
@@ -78,24 +95,52 @@ def create_app():
     
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return db.session.get(User, int(user_id))
     
     # Ensure upload directory exists
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
     with app.app_context():
-        db.create_all()
-        initialize_sample_data()
-        
-        # Check schema compatibility for promo code features
-        check_promo_schema_compatibility(app)
-        
         # Initialize bcrypt for the app context
         from models import bcrypt
         bcrypt.init_app(app)
         
-        # Create default admin user if none exists
-        create_default_admin_user()
+        # Workers started after `flask init-db` can set SKIP_DB_INIT to start instantly;
+        # flask CLI commands skip it too, so `flask init-db` can upgrade an outdated schema
+        if not os.environ.get('SKIP_DB_INIT') and not running_flask_cli:
+            initialize_database()
+        
+        # Open the pooled connections up front so the first requests don't pay for connecting;
+        # CLI commands only need one connection
+        if not running_flask_cli:
+            warm_connection_pool(app)
+        
+        # Warm the discount rule cache so rules edited while the app was down are picked up
+        try:
+            cache.get_discount_rules(force_refresh=True)
+        except Exception as e:
+            db.session.rollback()
+            print(f"WARNING: Could not warm discount rule cache: {e}")
+        
+        # Check schema compatibility for promo code features
+        check_promo_schema_compatibility(app)
+    
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create tables, indexes, sample data and the default admin user, upgrading the schema"""
+        initialize_database(upgrade_schema=True)
+        print("✅ Database initialized")
+    
+    @app.cli.command('rebuild-daily-sales')
+    @click.option('--days', type=int, default=None, help='Only rebuild the last N days')
+    def rebuild_daily_sales_command(days):
+        """Reconcile the daily sales pre-aggregates with completed transactions"""
+        start_date = (datetime.utcnow() - timedelta(days=days)).date() if days else None
+        AnalyticsService.rebuild_daily_sales(start_date)
+        print("✅ daily_sales rebuilt")
+    
+    # Audit log entries are batched per request and committed once the response is known to succeed
+    app.after_request(flush_pending_logs)
     
     # Register blueprints
     from views.auth import auth_bp
@@ -110,82 +155,188 @@ def create_app():
     return app
 
 
+def init_json_provider(app):
+    """Use an orjson-backed JSON provider, keeping Flask's default output for dates and Decimals"""
+    class OrjsonProvider(DefaultJSONProvider):
+        # Dates go through Flask's default hook so responses keep the HTTP date format
+        options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default, option=self.options).decode()
+        
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+    
+    app.json = OrjsonProvider(app)
+
+
+def init_session_store(app):
+    """Set up the session backend chosen by SESSION_TYPE, failing if it cannot be used"""
+    # Every worker must use the same store, so there is no per-worker fallback
+    session_type = app.config['SESSION_TYPE']
+    if session_type == 'cookie':
+        return
+    if session_type != 'redis':
+        raise RuntimeError(f"Unsupported SESSION_TYPE {session_type!r} - use 'redis' or 'cookie'")
+    
+    from flask_session import Session
+    
+    # flask-session stores serialized bytes, so it needs its own client without decode_responses
+    session_redis = redis.from_url(app.config['REDIS_URL'])
+    try:
+        session_redis.ping()
+    except redis.RedisError as e:
+        raise RuntimeError(f"SESSION_TYPE is 'redis' but Redis at REDIS_URL is unreachable: {e}") from e
+    
+    app.config['SESSION_REDIS'] = session_redis
+    Session(app)
+
+
+def warm_connection_pool(app):
+    """Check out every pooled connection once with SELECT 1 and return them to the pool"""
+    pool_size = app.config['SQLALCHEMY_ENGINE_OPTIONS'].get('pool_size', 0)
+    connections = []
+    try:
+        for _ in range(pool_size):
+            conn = db.engine.connect()
+            connections.append(conn)
+            conn.execute(text("SELECT 1"))
+    except Exception as e:
+        print(f"WARNING: Could not warm connection pool: {e}")
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+@contextmanager
+def database_init_lock():
+    """Serialize database initialization across workers starting at the same time"""
+    if db.engine.dialect.name != 'postgresql':
+        yield
+        return
+    
+    # Session-level advisory lock on a dedicated connection; other workers wait here
+    # and then find the schema and sample data already in place
+    with db.engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {'key': DB_INIT_LOCK_KEY})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': DB_INIT_LOCK_KEY})
+
+
+def initialize_database(upgrade_schema=False):
+    """Create schema, sample data and the default admin user if they are missing
+    
+    upgrade_schema runs the destructive generated column migration; only
+    `flask init-db` passes it, worker startup refuses to run on an outdated schema.
+    """
+    with database_init_lock():
+        db.create_all()
+        ensure_declared_indexes()
+        if upgrade_schema:
+            upgrade_generated_columns()
+        elif generated_column_upgrades():
+            raise RuntimeError(
+                "transaction_items generated columns are outdated - run `flask init-db` to upgrade the schema"
+            )
+        initialize_sample_data()
+        
+        # Backfill the daily sales pre-aggregate on first start after it was introduced
+        if DailySales.query.first() is None or ProductDailySales.query.first() is None:
+            AnalyticsService.rebuild_daily_sales()
+        
+        # Create default admin user if none exists
+        create_default_admin_user()
+
+
+def ensure_declared_indexes():
+    """Create indexes declared on models that are missing from already existing tables"""
+    # db.create_all() skips existing tables, so indexes added later would never be built
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except Exception as e:
+                # Expression indexes are not always reflected, so checkfirst may miss them
+                if 'already exists' not in str(e):
+                    print(f"WARNING: Could not create index {index.name}: {e}")
+
+
+def generated_column_upgrades():
+    """PostgreSQL DDL that brings the generated columns of transaction_items up to date"""
+    inspector = inspect(db.engine)
+    columns = {col['name']: col for col in inspector.get_columns('transaction_items')}
+    upgrades = []
+    
+    # PostgreSQL cannot turn a plain column into a generated one, so it is re-added;
+    # existing rows are recomputed from quantity * unit_price, which is what was stored
+    if not columns.get('total_price', {}).get('computed'):
+        upgrades.append(
+            "ALTER TABLE transaction_items DROP COLUMN total_price, "
+            "ADD COLUMN total_price NUMERIC(10, 2) GENERATED ALWAYS AS (quantity * unit_price) STORED"
+        )
+    
+    # Older sales get the product's current cost, which is what the reports used for them
+    if 'line_profit' not in columns:
+        if 'unit_cost' not in columns:
+            upgrades.append("ALTER TABLE transaction_items ADD COLUMN unit_cost NUMERIC(10, 2)")
+        upgrades.append(
+            "UPDATE transaction_items SET unit_cost = COALESCE(products.cost_price, 0) "
+            "FROM products WHERE products.id = transaction_items.product_id "
+            "AND transaction_items.unit_cost IS NULL"
+        )
+        upgrades.append(
+            "ALTER TABLE transaction_items ADD COLUMN line_profit NUMERIC(12, 2) "
+            "GENERATED ALWAYS AS (quantity * (unit_price - unit_cost)) STORED"
+        )
+    
+    return upgrades
+
+
+def upgrade_generated_columns():
+    """Convert the generated columns of transaction_items on an existing database"""
+    upgrades = generated_column_upgrades()
+    if not upgrades:
+        return
+    
+    # The model leaves generated columns out of INSERTs, so an unconverted table breaks every sale
+    if db.engine.dialect.name != 'postgresql':
+        raise RuntimeError(
+            f"transaction_items generated columns cannot be converted on {db.engine.dialect.name} - "
+            "recreate the table"
+        )
+    
+    with db.engine.begin() as conn:
+        for statement in upgrades:
+            conn.execute(text(statement))
+
+
 def check_promo_schema_compatibility(app):
     """Check if database schema supports promo code features"""
     try:
-        # Use proper schema inspection to check if promo_code_used column exists
+        # One inspector for both checks so its info_cache serves repeated reflection;
+        # it is created after initialization, so it sees the final schema
         inspector = inspect(db.engine)
-        transaction_columns = [col['name'] for col in inspector.get_columns('transactions')]
+        transaction_columns = {col['name'] for col in inspector.get_columns('transactions')}
         
-        if 'promo_code_used' in transaction_columns:
-            app.config['PROMO_FEATURES_ENABLED'] = True
-        else:
+        app.config['PROMO_FEATURES_ENABLED'] = 'promo_code_used' in transaction_columns
+        if not app.config['PROMO_FEATURES_ENABLED']:
             print("WARNING: Promo code features disabled - promo_code_used column not found in transactions table")
-            app.config['PROMO_FEATURES_ENABLED'] = False
+        
+        app.config['PROMO_CODES_TABLE_EXISTS'] = inspector.has_table('promo_codes')
+        if not app.config['PROMO_CODES_TABLE_EXISTS']:
+            print("WARNING: Promo codes table does not exist")
             
     except Exception as e:
         print(f"WARNING: Promo code features disabled due to schema check error: {e}")
         app.config['PROMO_FEATURES_ENABLED'] = False
-        
-    try:
-        # Check if promo_codes table exists
-        inspector = inspect(db.engine)
-        if inspector.has_table('promo_codes'):
-            app.config['PROMO_CODES_TABLE_EXISTS'] = True
-        else:
-            print("WARNING: Promo codes table does not exist")
-            app.config['PROMO_CODES_TABLE_EXISTS'] = False
-    except Exception as e:
-        print(f"WARNING: Could not check promo_codes table: {e}")
         app.config['PROMO_CODES_TABLE_EXISTS'] = False
 
 
 # Create the Flask app
 app = create_app()
 
-# Language support
-def get_language():
-    """Get current language from session"""
-    return session.get('language', 'kk')  # Default to Kazakh
-
-def get_text(kk_text, ru_text):
-    """Get text based on current language"""
-    if get_language() == 'ru':
-        return ru_text
-    return kk_text
-
-# Translation dictionaries
-TRANSLATIONS = {
-    'categories': {
-        'Сүт өнімдері': {'kk': 'Сүт өнімдері', 'ru': 'Молочные продукты'},
-        'Нан өнімдері': {'kk': 'Нан өнімдері', 'ru': 'Хлебобулочные'},
-        'Сусындар': {'kk': 'Сусындар', 'ru': 'Напитки'},
-        'Ет өнімдері': {'kk': 'Ет өнімдері', 'ru': 'Мясные продукты'},
-        'Жемістер мен көкөністер': {'kk': 'Жемістер мен көкөністер', 'ru': 'Фрукты и овощи'},
-    },
-    'products': {
-        'Сүт 3.2% 1л': {'kk': 'Сүт 3.2% 1л', 'ru': 'Молоко 3.2% 1л'},
-        'Нан ақ': {'kk': 'Нан ақ', 'ru': 'Хлеб белый'},
-        'Апельсин шырыны 1л': {'kk': 'Апельсин шырыны 1л', 'ru': 'Сок апельсиновый 1л'},
-        'Ірімшік қазақстандық': {'kk': 'Ірімшік қазақстандық', 'ru': 'Сыр казахстанский'},
-        'Алма қызыл': {'kk': 'Алма қызыл', 'ru': 'Яблоки красные'},
-    },
-    'units': {
-        'шт.': {'kk': 'дана', 'ru': 'шт.'},
-        'кг.': {'kk': 'кг.', 'ru': 'кг.'},
-        'л.': {'kk': 'л.', 'ru': 'л.'},
-        'м.': {'kk': 'м.', 'ru': 'м.'},
-        'упак.': {'kk': 'орам', 'ru': 'упак.'},
-    }
-}
-
-def translate_name(original_name, category='products'):
-    """Translate product/category name based on current language"""
-    translations = TRANSLATIONS.get(category, {})
-    if original_name in translations:
-        return translations[original_name].get(get_language(), original_name)
-    return original_name
-
 # Language switcher route
 @app.route('/set_language/<language>')
 def set_language(language):
@@ -227,8 +378,24 @@ def not_found_error(error):
 
 @app.errorhandler(500)
 def internal_error(error):
-    db.session.rollback()
+    # Nothing to roll back when the request never started (or already ended) a DB transaction
+    if db.session().in_transaction():
+        db.session.rollback()
+    if request.path.startswith('/api/'):
+        return jsonify({'success': False, 'error': 'Internal server error'}), 500
     return render_template('500.html'), 500
 
+@app.errorhandler(Exception)
+def api_error(error):
+    """Answer unhandled API errors with the JSON shape used by the routes, so they need no try/except"""
+    if isinstance(error, HTTPException):
+        return error
+    if not request.path.startswith('/api/'):
+        raise error
+    db.session.rollback()
+    # Details go to the log only; exception text can expose SQL and internals to the client
+    app.logger.exception('Unhandled error in %s', request.path)
+    return jsonify({'success': False, 'error': 'Internal server error'}), 500
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
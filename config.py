@@ -6,9 +6,14 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     DEBUG = os.environ.get('FLASK_ENV') != 'production'
+    # Short HTTP requests reuse hot connections (LIFO); hosted Postgres and its proxy drop
+    # idle connections, so they are recycled after 5 minutes and pinged on checkout
     SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": 10,
+        "max_overflow": 20,
         "pool_recycle": 300,
         "pool_pre_ping": True,
+        "pool_use_lifo": True,
     }
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'images')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
@@ -42,4 +47,10 @@ class Config:
     REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
     CACHE_TYPE = 'redis'
     CACHE_REDIS_URL = REDIS_URL
-    CACHE_DEFAULT_TIMEOUT = 300
\ No newline at end of file
+    CACHE_DEFAULT_TIMEOUT = 300
+    
+    # Session backend for every worker: 'redis' (flask-session, server-side) or 'cookie'
+    # (signed cookies). Startup fails if the configured store is unreachable
+    SESSION_TYPE = os.environ.get('SESSION_TYPE', 'cookie')
+    SESSION_PERMANENT = False
+    SESSION_KEY_PREFIX = 'pos_session:'
\ No newline at end of file
@@ -4,13 +4,14 @@ Handles creation of sample data for Kazakhstan market
 """
 from typing import List
 from datetime import datetime, timedelta
+from sqlalchemy import insert
 from models import (
     db, Category, Supplier, Product, PromoCode, 
     UnitType
 )
 
 
-def create_sample_categories() -> List[Category]:
+def create_sample_categories() -> List[int]:
     """Create sample categories for Kazakhstan market"""
     categories_data = [
         {"name": "Сүт өнімдері", "description": "Сүт, ірімшік, йогурт"},
@@ -20,31 +21,25 @@ def create_sample_categories() -> List[Category]:
         {"name": "Жемістер мен көкөністер", "description": "Жаңа жемістер мен көкөністер"}
     ]
     
-    categories = []
-    for data in categories_data:
-        category = Category()
-        category.name = data["name"]
-        category.description = data["description"]
-        categories.append(category)
-        db.session.add(category)
-    
-    return categories
+    # One multi-row INSERT; ids come back in the order of categories_data
+    return db.session.scalars(
+        insert(Category).returning(Category.id, sort_by_parameter_order=True),
+        categories_data
+    ).all()
 
 
-def create_sample_supplier() -> Supplier:
+def create_sample_supplier() -> int:
     """Create sample supplier for Kazakhstan market"""
-    supplier = Supplier()
-    supplier.name = "ЖШС АлматыТрейд"
-    supplier.contact_person = "Асылбек Нұрболов"
-    supplier.phone = "+7 (727) 250-30-40"
-    supplier.email = "orders@almatytrade.kz"
-    supplier.address = "Алматы қ., Абай д-лы, 120, 050000"
-    
-    db.session.add(supplier)
-    return supplier
+    return db.session.scalar(insert(Supplier).returning(Supplier.id), {
+        "name": "ЖШС АлматыТрейд",
+        "contact_person": "Асылбек Нұрболов",
+        "phone": "+7 (727) 250-30-40",
+        "email": "orders@almatytrade.kz",
+        "address": "Алматы қ., Абай д-лы, 120, 050000"
+    })
 
 
-def create_sample_products(supplier: Supplier, categories: List[Category]) -> List[Product]:
+def create_sample_products(supplier_id: int, category_ids: List[int]) -> None:
     """Create sample products for Kazakhstan market"""
     products_data = [
         {
@@ -74,26 +69,14 @@ def create_sample_products(supplier: Supplier, categories: List[Category]) -> Li
         }
     ]
     
-    products = []
     for data in products_data:
-        product = Product()
-        product.sku = data["sku"]
-        product.name = data["name"]
-        product.price = data["price"]
-        product.cost_price = data["cost_price"]
-        product.stock_quantity = data["stock_quantity"]
-        product.min_stock_level = data["min_stock_level"]
-        product.unit_type = data["unit_type"]
-        product.supplier_id = supplier.id
-        product.category_id = categories[data["category_idx"]].id
-        
-        products.append(product)
-        db.session.add(product)
+        data["supplier_id"] = supplier_id
+        data["category_id"] = category_ids[data.pop("category_idx")]
     
-    return products
+    db.session.execute(insert(Product), products_data)
 
 
-def create_sample_promo_codes() -> List[PromoCode]:
+def create_sample_promo_codes() -> None:
     """Create sample promo codes for testing"""
     promo_data = [
         {
@@ -120,35 +103,23 @@ def create_sample_promo_codes() -> List[PromoCode]:
         }
     ]
     
-    promos = []
-    for data in promo_data:
-        promo = PromoCode()
-        for key, value in data.items():
-            setattr(promo, key, value)
-        
-        promos.append(promo)
-        db.session.add(promo)
-    
-    return promos
+    db.session.execute(insert(PromoCode), promo_data)
 
 
 def initialize_sample_data() -> None:
     """Initialize database with sample data if empty"""
     if Category.query.count() == 0:
         # Create categories for Kazakhstan market
-        categories = create_sample_categories()
+        category_ids = create_sample_categories()
         
         # Create Kazakhstan supplier
-        supplier = create_sample_supplier()
-        
-        db.session.commit()
+        supplier_id = create_sample_supplier()
         
         # Create sample products for Kazakhstan market
-        products = create_sample_products(supplier, categories)
-        
-        db.session.commit()
+        create_sample_products(supplier_id, category_ids)
         
         # Create sample promo codes for testing
         if PromoCode.query.count() == 0:
-            promos = create_sample_promo_codes()
-            db.session.commit()
\ No newline at end of file
+            create_sample_promo_codes()
+        
+        db.session.commit()
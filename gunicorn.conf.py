@@ -0,0 +1,11 @@
+import multiprocessing
+import os
+
+# Gunicorn picks this file up automatically from the working directory.
+# Requests spend most of their time waiting on PostgreSQL/Redis, so each worker
+# serves several of them concurrently on threads instead of one at a time.
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+worker_class = 'gthread'
+# Keep below the SQLAlchemy pool (pool_size + max_overflow) so threads never wait for a connection
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = 60
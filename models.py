@@ -3,7 +3,8 @@ from flask_login import UserMixin
 from flask_bcrypt import Bcrypt
 from datetime import datetime
 from enum import Enum
-from sqlalchemy import func
+from sqlalchemy import func, event, DDL, text
+from sqlalchemy.orm import validates
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
@@ -141,6 +142,23 @@ class Product(db.Model):
     transaction_items = db.relationship('TransactionItem', backref='product', lazy=True)
     purchase_order_items = db.relationship('PurchaseOrderItem', backref='product', lazy=True)
     
+    # Trigram indexes let the '%term%' ILIKE product search use an index scan (PostgreSQL only)
+    __table_args__ = (
+        db.Index('ix_product_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_product_sku_trgm', 'sku', postgresql_using='gin',
+                 postgresql_ops={'sku': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        # Every column in an ILIKE OR-search needs one, otherwise the planner falls back to a seq scan
+        db.Index('ix_product_description_trgm', 'description', postgresql_using='gin',
+                 postgresql_ops={'description': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_product_barcode_trgm', 'barcode', postgresql_using='gin',
+                 postgresql_ops={'barcode': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        # Partial index holding only products at or below their reorder level, for low-stock counts
+        db.Index('ix_product_low_stock', 'is_active',
+                 postgresql_where=text('stock_quantity <= min_stock_level'),
+                 sqlite_where=text('stock_quantity <= min_stock_level')),
+    )
+    
     @property
     def is_low_stock(self):
         return self.stock_quantity <= self.min_stock_level
@@ -151,6 +169,17 @@ class Product(db.Model):
             return ((self.price - self.cost_price) / self.price * 100)
         return 0
 
+# gin_trgm_ops used by the product search indexes comes from the pg_trgm extension
+event.listen(
+    db.metadata,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
+# Counters for transaction/purchase order numbers on PostgreSQL (wrap after 999999, numbers are also prefixed by date)
+transaction_number_seq = db.Sequence('transaction_number_seq', maxvalue=999999, cycle=True, metadata=db.metadata)
+order_number_seq = db.Sequence('order_number_seq', maxvalue=999999, cycle=True, metadata=db.metadata)
+
 class Transaction(db.Model):
     __tablename__ = 'transactions'
     
@@ -174,6 +203,36 @@ class Transaction(db.Model):
     # Relationships
     items = db.relationship('TransactionItem', backref='transaction', lazy=True, cascade='all, delete-orphan')
     payments = db.relationship('Payment', backref='transaction', lazy=True, cascade='all, delete-orphan')
+    
+    # Dashboard and report queries filter completed transactions by date range
+    __table_args__ = (
+        db.Index('ix_tx_status_created', 'status', 'created_at'),
+    )
+
+class DailySales(db.Model):
+    """Pre-aggregated completed sales per day, updated when a transaction completes"""
+    __tablename__ = 'daily_sales'
+    
+    date = db.Column(db.Date, primary_key=True)
+    total_revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0.00)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ProductDailySales(db.Model):
+    """Pre-aggregated completed sales per product and day, updated when a transaction completes"""
+    __tablename__ = 'product_daily_sales'
+    
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    quantity = db.Column(db.Numeric(12, 3), nullable=False, default=0)
+    total_revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0.00)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Ranking queries read a date range across all products
+    __table_args__ = (
+        db.Index('ix_product_daily_sales_date', 'date'),
+    )
 
 class TransactionItem(db.Model):
     __tablename__ = 'transaction_items'
@@ -182,11 +241,20 @@ class TransactionItem(db.Model):
     quantity = db.Column(db.Numeric(10, 3), nullable=False)
     unit_price = db.Column(db.Numeric(10, 2), nullable=False)
     discount_amount = db.Column(db.Numeric(10, 2), default=0.00)
-    total_price = db.Column(db.Numeric(10, 2), nullable=False)
+    # Computed by the database on INSERT/UPDATE; line discounts are kept separately in discount_amount
+    total_price = db.Column(db.Numeric(10, 2), db.Computed('quantity * unit_price', persisted=True))
+    # Product cost at the time of sale, so profit does not follow later cost or price edits
+    unit_cost = db.Column(db.Numeric(10, 2))
+    line_profit = db.Column(db.Numeric(12, 2), db.Computed('quantity * (unit_price - unit_cost)', persisted=True))
     
     # Foreign keys
     transaction_id = db.Column(db.Integer, db.ForeignKey('transactions.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    
+    # Cart lookups, subtotal sums and report joins all go through transaction_id
+    __table_args__ = (
+        db.Index('ix_txi_tx_prod', 'transaction_id', 'product_id'),
+    )
 
 class Payment(db.Model):
     __tablename__ = 'payments'
@@ -260,6 +328,13 @@ class DiscountRule(db.Model):
     start_date = db.Column(db.DateTime)
     end_date = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Only active rules are ever read, filtered by their date window
+    __table_args__ = (
+        db.Index('ix_discount_rules_active_dates', 'start_date', 'end_date',
+                 postgresql_where=text('is_active'),
+                 sqlite_where=text('is_active')),
+    )
 
 class PromoCode(db.Model):
     __tablename__ = 'promo_codes'
@@ -285,4 +360,14 @@ class PromoCode(db.Model):
         db.CheckConstraint('discount_value >= 0', name='check_discount_value_positive'),
         db.CheckConstraint('current_uses >= 0', name='check_current_uses_positive'),
         db.CheckConstraint('max_uses IS NULL OR max_uses >= 0', name='check_max_uses_positive'),
-    )
\ No newline at end of file
+        db.CheckConstraint('code = UPPER(code)', name='check_code_uppercase'),
+    )
+    
+    @staticmethod
+    def normalize_code(code):
+        """Canonical form of a promo code as entered by a cashier or admin"""
+        return (code or '').strip().upper()
+    
+    @validates('code')
+    def validate_code(self, key, code):
+        return PromoCode.normalize_code(code)
\ No newline at end of file
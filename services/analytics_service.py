@@ -3,12 +3,139 @@ Analytics and reporting business logic service
 """
 from datetime import datetime, timedelta
 from sqlalchemy import func, desc, text
-from models import db, Transaction, TransactionItem, Product, Category, Supplier, TransactionStatus
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Transaction, TransactionItem, Product, Category, Supplier, TransactionStatus, DailySales
+from models import ProductDailySales
 
 
 class AnalyticsService:
     """Service for handling analytics and reporting business logic"""
     
+    @staticmethod
+    def record_completed_sale(transaction):
+        """Add a completed transaction to its day in the daily_sales pre-aggregate"""
+        day = transaction.created_at.date()
+        amount = transaction.total_amount or 0
+        dialect = db.session.get_bind().dialect.name
+        
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            stmt = insert(DailySales).values(
+                date=day,
+                total_revenue=amount,
+                transaction_count=1,
+                updated_at=datetime.utcnow()
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[DailySales.date],
+                set_={
+                    'total_revenue': DailySales.total_revenue + stmt.excluded.total_revenue,
+                    'transaction_count': DailySales.transaction_count + 1,
+                    'updated_at': stmt.excluded.updated_at
+                }
+            )
+            db.session.execute(stmt)
+            AnalyticsService.record_product_sales(transaction, day, insert)
+            return
+        
+        # Fallback for databases without ON CONFLICT support
+        daily = db.session.query(DailySales).filter_by(date=day).with_for_update().first()
+        if not daily:
+            daily = DailySales(date=day, total_revenue=0, transaction_count=0)  # type: ignore
+            db.session.add(daily)
+        daily.total_revenue += amount
+        daily.transaction_count += 1
+        AnalyticsService.record_product_sales(transaction, day)
+    
+    @staticmethod
+    def record_product_sales(transaction, day, insert=None):
+        """Add a completed transaction's items to product_daily_sales"""
+        # One row per product: ON CONFLICT may not touch the same row twice in a statement
+        totals = {}
+        for item in transaction.items:
+            quantity, revenue, count = totals.get(item.product_id, (0, 0, 0))
+            totals[item.product_id] = (quantity + item.quantity, revenue + (item.total_price or 0), count + 1)
+        if not totals:
+            return
+        
+        now = datetime.utcnow()
+        if insert is not None:
+            stmt = insert(ProductDailySales).values([{
+                'product_id': product_id,
+                'date': day,
+                'quantity': quantity,
+                'total_revenue': revenue,
+                'item_count': count,
+                'updated_at': now
+            } for product_id, (quantity, revenue, count) in totals.items()])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ProductDailySales.product_id, ProductDailySales.date],
+                set_={
+                    'quantity': ProductDailySales.quantity + stmt.excluded.quantity,
+                    'total_revenue': ProductDailySales.total_revenue + stmt.excluded.total_revenue,
+                    'item_count': ProductDailySales.item_count + stmt.excluded.item_count,
+                    'updated_at': stmt.excluded.updated_at
+                }
+            )
+            db.session.execute(stmt)
+            return
+        
+        for product_id, (quantity, revenue, count) in totals.items():
+            daily = db.session.query(ProductDailySales).filter_by(
+                product_id=product_id, date=day
+            ).with_for_update().first()
+            if not daily:
+                daily = ProductDailySales(product_id=product_id, date=day, quantity=0, total_revenue=0, item_count=0)  # type: ignore
+                db.session.add(daily)
+            daily.quantity += quantity
+            daily.total_revenue += revenue
+            daily.item_count += count
+    
+    @staticmethod
+    def rebuild_daily_sales(start_date=None):
+        """Recompute daily_sales and product_daily_sales from completed transactions (reconciliation)"""
+        delete_query = DailySales.query
+        product_delete_query = ProductDailySales.query
+        source_query = db.session.query(
+            func.date(Transaction.created_at),
+            func.sum(Transaction.total_amount),
+            func.count(Transaction.id),
+            func.now()
+        ).filter(Transaction.status == TransactionStatus.COMPLETED)
+        product_source_query = db.session.query(
+            TransactionItem.product_id,
+            func.date(Transaction.created_at),
+            func.sum(TransactionItem.quantity),
+            func.sum(TransactionItem.total_price),
+            func.count(TransactionItem.id),
+            func.now()
+        ).join(
+            Transaction, TransactionItem.transaction_id == Transaction.id
+        ).filter(Transaction.status == TransactionStatus.COMPLETED)
+        
+        if start_date:
+            period_start = datetime.combine(start_date, datetime.min.time())
+            delete_query = delete_query.filter(DailySales.date >= start_date)
+            product_delete_query = product_delete_query.filter(ProductDailySales.date >= start_date)
+            source_query = source_query.filter(Transaction.created_at >= period_start)
+            product_source_query = product_source_query.filter(Transaction.created_at >= period_start)
+        
+        delete_query.delete(synchronize_session=False)
+        product_delete_query.delete(synchronize_session=False)
+        db.session.execute(
+            DailySales.__table__.insert().from_select(
+                ['date', 'total_revenue', 'transaction_count', 'updated_at'],
+                source_query.group_by(func.date(Transaction.created_at))
+            )
+        )
+        db.session.execute(
+            ProductDailySales.__table__.insert().from_select(
+                ['product_id', 'date', 'quantity', 'total_revenue', 'item_count', 'updated_at'],
+                product_source_query.group_by(TransactionItem.product_id, func.date(Transaction.created_at))
+            )
+        )
+        db.session.commit()
+    
     @staticmethod
     def get_sales_summary(start_date=None, end_date=None):
         """Get sales summary for date range"""
@@ -57,7 +184,7 @@ class AnalyticsService:
             Product.cost_price,
             func.sum(TransactionItem.quantity).label('total_sold'),
             func.sum(TransactionItem.total_price).label('total_revenue'),
-            func.sum((Product.price - Product.cost_price) * TransactionItem.quantity).label('total_profit')
+            func.sum(TransactionItem.line_profit).label('total_profit')
         ).join(
             TransactionItem, Product.id == TransactionItem.product_id
         ).join(
@@ -93,7 +220,7 @@ class AnalyticsService:
         category_analysis = db.session.query(
             Category.name,
             func.sum(TransactionItem.total_price).label('total_revenue'),
-            func.sum((Product.price - Product.cost_price) * TransactionItem.quantity).label('total_profit'),
+            func.sum(TransactionItem.line_profit).label('total_profit'),
             func.count(TransactionItem.id).label('total_transactions')
         ).join(
             Product, Category.id == Product.category_id
@@ -1,7 +1,7 @@
 # Redis кэширование для POS системы
 import json
 import redis
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
 from flask import current_app
 from typing import Optional, List, Dict, Any, Callable
 
@@ -228,29 +228,35 @@ class CacheService:
         
         def fetch_dashboard_stats():
             from models import Product, Transaction, TransactionStatus, db
-            from sqlalchemy import func
-            today = datetime.now().date()
-            
-            # Общее количество активных товаров
-            total_products = Product.query.filter_by(is_active=True).count()
-            
-            # Товары с низким остатком
-            low_stock_count = Product.query.filter(
-                Product.stock_quantity <= Product.min_stock_level,
-                Product.is_active == True
-            ).count()
+            from sqlalchemy import func, case
+            # Полуинтервал [сегодня, завтра) вместо func.date(created_at), чтобы работал индекс по created_at
+            today_start = datetime.combine(datetime.now().date(), time.min)
+            tomorrow_start = today_start + timedelta(days=1)
             
-            # Продажи за сегодня
-            today_sales = db.session.query(func.sum(Transaction.total_amount)).filter(
-                func.date(Transaction.created_at) == today,
+            # Сегодняшние продажи — скалярные подзапросы, чтобы вся статистика пришла за один запрос
+            today_filter = (
+                Transaction.created_at >= today_start,
+                Transaction.created_at < tomorrow_start,
                 Transaction.status == TransactionStatus.COMPLETED
-            ).scalar() or 0
+            )
+            today_sales_subquery = db.session.query(
+                func.sum(Transaction.total_amount)
+            ).filter(*today_filter).scalar_subquery()
+            today_transactions_subquery = db.session.query(
+                func.count(Transaction.id)
+            ).filter(*today_filter).scalar_subquery()
             
-            # Количество транзакций за сегодня
-            today_transactions = Transaction.query.filter(
-                func.date(Transaction.created_at) == today,
-                Transaction.status == TransactionStatus.COMPLETED
-            ).count()
+            # Количество активных товаров и товаров с низким остатком вместе с продажами за сегодня
+            stats = db.session.query(
+                func.count(Product.id).label('total_products'),
+                func.sum(case((Product.stock_quantity <= Product.min_stock_level, 1), else_=0)).label('low_stock_count'),
+                today_sales_subquery.label('today_sales'),
+                today_transactions_subquery.label('today_transactions')
+            ).filter(Product.is_active == True).one()
+            total_products = stats.total_products
+            low_stock_count = int(stats.low_stock_count or 0)
+            today_sales = stats.today_sales or 0
+            today_transactions = int(stats.today_transactions or 0)
             
             return {
                 'total_products': total_products,
@@ -265,12 +271,88 @@ class CacheService:
         self.set(cache_key, data, ttl=120)
         return data
     
+    def get_discount_rules(self, force_refresh=False):
+        """Получение всех включенных правил скидок (кэширование)"""
+        cache_key = "discount_rules"
+        
+        if not force_refresh:
+            cached_data = self.get(cache_key)
+            if cached_data is not None:
+                return cached_data
+        
+        def fetch_discount_rules():
+            from models import DiscountRule, Category, db
+            # Период действия не фильтруется здесь - его проверяет вызывающий код по текущему времени
+            rules = db.session.query(DiscountRule, Category.name).outerjoin(
+                Category, DiscountRule.category_id == Category.id
+            ).filter(DiscountRule.is_active == True).all()
+            
+            return [{
+                'id': rule.id,
+                'name': rule.name,
+                'description': rule.description,
+                'discount_type': rule.discount_type,
+                'discount_value': float(rule.discount_value),
+                'min_amount': float(rule.min_amount or 0),
+                'category_name': category_name,
+                'start_date': rule.start_date.isoformat() if rule.start_date else None,
+                'end_date': rule.end_date.isoformat() if rule.end_date else None
+            } for rule, category_name in rules]
+        
+        data = fetch_discount_rules()
+        # Кэшируем на 10 минут, правила меняются редко
+        self.set(cache_key, data, ttl=600)
+        return data
+    
+    def invalidate_discount_rules(self):
+        """Сброс кэша правил скидок после их изменения"""
+        self.delete("discount_rules")
+    
+    # Кэширование карточки товара для кассы (lookaside по id)
+    def get_product_snapshot(self, product_id, ttl=60):
+        """Получение полей товара, нужных при сканировании на кассе"""
+        cache_key = f"product:{product_id}:snapshot"
+        
+        cached_data = self.get(cache_key)
+        # Карточки без cost_price остались от старой версии и перечитываются
+        if cached_data and 'cost_price' in cached_data:
+            return cached_data
+        
+        from models import Product, db
+        product = db.session.get(Product, product_id)
+        if not product:
+            return None
+        
+        data = {
+            'id': product.id,
+            'name': product.name,
+            'price': str(product.price),  # строка, чтобы не терять точность Decimal
+            'cost_price': str(product.cost_price or 0),
+            'stock_quantity': product.stock_quantity
+        }
+        self.set(cache_key, data, ttl=ttl)
+        return data
+    
+    def invalidate_product_snapshots(self, product_ids):
+        """Сброс карточек товаров после изменения остатков"""
+        if not product_ids or not self.is_available():
+            return False
+        
+        try:
+            keys = [f"product:{product_id}:snapshot" for product_id in product_ids]
+            return self.redis_client.delete(*keys) > 0
+        except Exception as e:
+            current_app.logger.error(f"Cache DELETE error for product snapshots: {e}")
+            return False
+    
     def invalidate_product_cache(self, product_id=None):
         """Сброс кэша товаров при обновлении"""
         patterns = [
             "popular_products:*",
             "categories_with_counts",
-            "dashboard_stats:*"
+            "dashboard_stats:*",
+            "sales_summary:*",
+            "reports_data:*"
         ]
         
         if product_id:
@@ -287,7 +369,9 @@ class CacheService:
     def invalidate_sales_cache(self):
         """Сброс кэша продаж"""
         self.delete_pattern("dashboard_stats:*")
+        self.delete_pattern("sales_summary:*")
         self.delete_pattern("popular_products:*")
+        self.delete_pattern("reports_data:*")
     
     def get_cache_info(self):
         """Получение информации о состоянии кэша"""
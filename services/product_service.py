@@ -4,6 +4,7 @@ Product and inventory business logic service
 from models import db, Product, Category, Supplier, Transaction, TransactionItem, TransactionStatus
 from sqlalchemy import or_, desc, func
 from utils.helpers import log_operation
+from services.cache_service import cache_service
 from utils.image_processing import process_product_image, delete_product_image, generate_unique_filename
 from utils.language import translate_name, get_language
 
@@ -31,8 +32,9 @@ class ProductService:
         products = products_query.limit(min(limit, 50)).all()
         
         # Translate product names for current language
+        language = get_language()
         for product in products:
-            product.translated_name = translate_name(product.name)
+            product.translated_name = translate_name(product.name, 'products', language)
         
         return products
     
@@ -48,6 +50,11 @@ class ProductService:
         
         return product
     
+    @staticmethod
+    def sku_exists(sku):
+        """Check whether a product with this SKU exists without loading it"""
+        return db.session.query(Product.query.filter_by(sku=sku).exists()).scalar()
+    
     @staticmethod
     def get_popular_products(limit=10, days=30):
         """Get popular products based on sales"""
@@ -90,11 +97,11 @@ class ProductService:
                 raise ValueError(f'Поле {field} обязательно')
         
         # Check if SKU already exists
-        if data.get('sku') and Product.query.filter_by(sku=data['sku']).first():
+        if data.get('sku') and ProductService.sku_exists(data['sku']):
             raise ValueError('SKU уже существует')
         
         # Check if barcode already exists
-        if data.get('barcode') and Product.query.filter_by(barcode=data['barcode']).first():
+        if data.get('barcode') and db.session.query(Product.query.filter_by(barcode=data['barcode']).exists()).scalar():
             raise ValueError('Штрихкод уже существует')
         
         product = Product()
@@ -112,7 +119,7 @@ class ProductService:
     @staticmethod
     def update_product(product_id, data):
         """Update existing product"""
-        product = Product.query.get(product_id)
+        product = db.session.get(Product, product_id)
         if not product:
             raise ValueError('Товар не найден')
         
@@ -129,6 +136,8 @@ class ProductService:
                 setattr(product, key, value)
         
         db.session.commit()
+        # Price and stock are served to the till from the product snapshot cache
+        cache_service.invalidate_product_cache(product.id)
         
         # Store new values for logging
         new_values = {
@@ -144,7 +153,7 @@ class ProductService:
     @staticmethod
     def update_stock(product_id, quantity, operation='set'):
         """Update product stock"""
-        product = Product.query.get(product_id)
+        product = db.session.get(Product, product_id)
         if not product:
             raise ValueError('Товар не найден')
         
@@ -160,6 +169,7 @@ class ProductService:
             product.stock_quantity = quantity
         
         db.session.commit()
+        cache_service.invalidate_product_cache(product.id)
         
         log_operation(
             'inventory_update',
@@ -175,7 +185,7 @@ class ProductService:
     @staticmethod
     def upload_product_image(product_id, file):
         """Upload and process product image"""
-        product = Product.query.get(product_id)
+        product = db.session.get(Product, product_id)
         if not product:
             raise ValueError('Товар не найден')
         
@@ -202,7 +212,7 @@ class ProductService:
     @staticmethod
     def delete_product_image(product_id):
         """Delete product image"""
-        product = Product.query.get(product_id)
+        product = db.session.get(Product, product_id)
         if not product:
             raise ValueError('Товар не найден')
         
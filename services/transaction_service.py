@@ -3,11 +3,34 @@ Transaction business logic service
 """
 from decimal import Decimal
 from datetime import datetime
-from flask import session
+from flask import session, current_app
 from flask_login import current_user
 from models import db, Transaction, TransactionItem, Product, TransactionStatus, PaymentMethod, Payment, PromoCode
-from sqlalchemy import func
+from sqlalchemy import func, case, select, update, or_, bindparam
+from sqlalchemy.orm import selectinload, joinedload
 from utils.helpers import generate_transaction_number, log_operation
+from services.analytics_service import AnalyticsService
+from services.cache_service import cache_service
+
+
+# Codes are stored normalized (code = UPPER(code)), so they are compared as-is
+ACTIVE_PROMO_CODE = (PromoCode.code == bindparam('promo_code'), PromoCode.is_active == True)
+
+# Counts one use of an active promo code that still has uses left; no row comes back
+# when the code is exhausted, so concurrent checkouts need no lock on the promo row
+PROMO_USAGE_INCREMENT = (
+    update(PromoCode)
+    .where(
+        *ACTIVE_PROMO_CODE,
+        or_(func.coalesce(PromoCode.max_uses, 0) == 0, PromoCode.current_uses < PromoCode.max_uses)
+    )
+    .values(current_uses=PromoCode.current_uses + 1)
+    .returning(PromoCode.current_uses)
+    .execution_options(synchronize_session=False)
+)
+
+# Tells an exhausted code apart from one that was deleted or deactivated after it was applied
+ACTIVE_PROMO_CODE_EXISTS = select(select(PromoCode.id).where(*ACTIVE_PROMO_CODE).exists())
 
 
 class TransactionService:
@@ -34,11 +57,11 @@ class TransactionService:
     @staticmethod
     def add_item_to_transaction(transaction_id, product_id, quantity):
         """Add item to transaction with stock validation"""
-        transaction = Transaction.query.get(transaction_id)
+        transaction = db.session.get(Transaction, transaction_id)
         if not transaction or transaction.status != TransactionStatus.PENDING:
             raise ValueError('Транзакция недоступна')
         
-        product = Product.query.get(product_id)
+        product = db.session.get(Product, product_id)
         if not product:
             raise ValueError('Товар не найден')
         
@@ -47,7 +70,7 @@ class TransactionService:
             raise ValueError('Неверное количество')
         
         # Check stock
-        if product.stock_quantity < float(quantity):
+        if product.stock_quantity < quantity:
             raise ValueError('Недостаточно товара на складе')
         
         # Create new item
@@ -56,9 +79,10 @@ class TransactionService:
         item.product_id = product.id
         item.quantity = quantity
         item.unit_price = product.price
-        item.total_price = quantity * product.price
+        item.unit_cost = product.cost_price or Decimal('0.00')
         item.discount_amount = Decimal('0.00')
         db.session.add(item)
+        db.session.flush()  # total_price is generated by the database
         
         # Update transaction totals
         TransactionService.update_transaction_totals(transaction)
@@ -69,15 +93,20 @@ class TransactionService:
     @staticmethod
     def update_transaction_totals(transaction):
         """Update transaction totals based on items"""
-        if not transaction.items:
+        # Count and sum the items in the database instead of loading the collection
+        item_count, subtotal = db.session.query(
+            func.count(TransactionItem.id),
+            func.coalesce(func.sum(TransactionItem.total_price - func.coalesce(TransactionItem.discount_amount, 0)), 0)
+        ).filter(TransactionItem.transaction_id == transaction.id).one()
+        
+        if not item_count:
             transaction.subtotal = Decimal('0.00')
             transaction.discount_amount = Decimal('0.00')
             transaction.tax_amount = Decimal('0.00')
             transaction.total_amount = Decimal('0.00')
             return
         
-        # Calculate subtotal from items
-        subtotal = sum(item.total_price - item.discount_amount for item in transaction.items)
+        subtotal = Decimal(subtotal)
         
         # Apply transaction-level discount
         discount_amount = transaction.discount_amount or Decimal('0.00')
@@ -96,49 +125,98 @@ class TransactionService:
         transaction.tax_amount = tax_amount
         transaction.total_amount = total_amount
     
+    @staticmethod
+    def decrement_sold_stock(stock_deltas):
+        """Take a sale's quantities ({product_id: quantity}) off stock; returns {product_id: new stock}
+        
+        Decrement and check share one UPDATE so concurrent sales cannot oversell;
+        when any product is short the session is rolled back and ValueError raised.
+        """
+        if not stock_deltas:
+            return {}
+        
+        sold_quantity = case(stock_deltas, value=Product.id)
+        new_stock = dict(db.session.execute(
+            update(Product)
+            .where(Product.id.in_(stock_deltas), Product.stock_quantity >= sold_quantity)
+            .values(stock_quantity=Product.stock_quantity - sold_quantity)
+            .returning(Product.id, Product.stock_quantity)
+            .execution_options(synchronize_session=False)
+        ).all())
+        if len(new_stock) != len(stock_deltas):
+            db.session.rollback()
+            raise ValueError('Недостаточно товара на складе')
+        return new_stock
+    
+    @staticmethod
+    def count_promo_code_use(transaction):
+        """Count one use of the promo code applied to a transaction being completed"""
+        if not (transaction.promo_code_used
+                and current_app.config.get('PROMO_FEATURES_ENABLED', False)
+                and current_app.config.get('PROMO_CODES_TABLE_EXISTS', False)):
+            return
+        
+        params = {'promo_code': PromoCode.normalize_code(transaction.promo_code_used)}
+        if db.session.execute(PROMO_USAGE_INCREMENT, params).first():
+            return
+        
+        # No row: only a code that is still active ran out of uses; a code deleted or
+        # deactivated after it was applied is not counted and the sale goes through
+        if db.session.execute(ACTIVE_PROMO_CODE_EXISTS, params).scalar():
+            db.session.rollback()
+            raise ValueError('Промокод исчерпан на момент завершения транзакции')
+    
+    @staticmethod
+    def finalize_completed_sale(transaction, stock_deltas):
+        """Mark a paid transaction completed with its sales rollups, commit, and drop stale caches
+        
+        Every checkout path ends here so daily_sales, product_daily_sales and the
+        cached summaries and product snapshots stay in step with completed sales.
+        """
+        transaction.status = TransactionStatus.COMPLETED
+        transaction.completed_at = datetime.utcnow()
+        transaction.user_id = current_user.id if current_user.is_authenticated else None
+        
+        AnalyticsService.record_completed_sale(transaction)
+        db.session.commit()
+        
+        cache_service.invalidate_sales_cache()
+        cache_service.invalidate_product_snapshots(stock_deltas)
+    
     @staticmethod
     def complete_transaction(transaction_id, payments):
         """Complete transaction with payments and stock updates"""
-        transaction = Transaction.query.get(transaction_id)
+        transaction = db.session.get(
+            Transaction, transaction_id,
+            options=[selectinload(Transaction.items).joinedload(TransactionItem.product)]
+        )
         if not transaction or transaction.status != TransactionStatus.PENDING:
             raise ValueError('Транзакция недоступна')
         
         # Validate payment amounts
-        total_payment = sum(Decimal(str(p['amount'])) for p in payments)
+        payment_amounts = [Decimal(str(p['amount'])) for p in payments]
+        total_payment = sum(payment_amounts)
         if abs(total_payment - transaction.total_amount) > Decimal('0.01'):
             raise ValueError('Сумма оплаты не совпадает с общей суммой')
         
         # Create payment records
-        for payment_data in payments:
+        for payment_data, amount in zip(payments, payment_amounts):
             payment = Payment()
             payment.transaction_id = transaction.id
             payment.method = PaymentMethod(payment_data['method'])
-            payment.amount = Decimal(str(payment_data['amount']))
+            payment.amount = amount
             payment.reference_number = payment_data.get('reference_number')
             db.session.add(payment)
         
-        # Update stock quantities
+        # Update stock quantities for all products in a single guarded UPDATE
+        stock_deltas = {}
         for item in transaction.items:
-            item.product.stock_quantity -= int(item.quantity)
-        
-        # Handle promo code usage increment if promo code was used
-        if transaction.promo_code_used:
-            promo = db.session.query(PromoCode).filter(
-                func.upper(PromoCode.code) == transaction.promo_code_used.upper(),
-                PromoCode.is_active == True
-            ).with_for_update().first()
-            
-            if promo:
-                if promo.max_uses and promo.current_uses >= promo.max_uses:
-                    raise ValueError('Промокод исчерпан на момент завершения транзакции')
-                promo.current_uses += 1
-        
-        # Complete transaction
-        transaction.status = TransactionStatus.COMPLETED
-        transaction.completed_at = datetime.utcnow()
-        transaction.user_id = current_user.id if current_user.is_authenticated else None
+            stock_deltas[item.product_id] = stock_deltas.get(item.product_id, 0) + int(item.quantity)
+        TransactionService.decrement_sold_stock(stock_deltas)
         
-        db.session.commit()
+        TransactionService.count_promo_code_use(transaction)
+        
+        TransactionService.finalize_completed_sale(transaction, stock_deltas)
         
         # Log the completed sale
         log_operation(
@@ -163,7 +241,7 @@ class TransactionService:
     @staticmethod
     def suspend_transaction(transaction_id):
         """Suspend current transaction"""
-        transaction = Transaction.query.get(transaction_id)
+        transaction = db.session.get(Transaction, transaction_id)
         if not transaction or transaction.status != TransactionStatus.PENDING:
             raise ValueError('Транзакция недоступна')
         
@@ -178,7 +256,7 @@ class TransactionService:
     @staticmethod
     def restore_transaction(transaction_id):
         """Restore suspended transaction"""
-        transaction = Transaction.query.get(transaction_id)
+        transaction = db.session.get(Transaction, transaction_id)
         if not transaction or transaction.status != TransactionStatus.SUSPENDED:
             raise ValueError('Транзакция недоступна для восстановления')
         
@@ -0,0 +1,58 @@
+"""
+Tests for product image upload utilities
+"""
+import io
+import os
+
+import pytest
+from flask import Flask
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from config import Config
+from utils.image_processing import validate_image, process_product_image
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    with app.app_context():
+        yield app
+
+
+def mpo_upload(filename='camera.jpg', size=(1600, 1200)):
+    """JPEG with an MPF marker, as written by phone cameras"""
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(
+        buffer, 'MPO', save_all=True, append_images=[Image.new('RGB', size, 'blue')]
+    )
+    buffer.seek(0)
+    return FileStorage(stream=buffer, filename=filename, content_type='image/jpeg')
+
+
+def test_mpo_fixture_is_detected_as_mpo():
+    upload = mpo_upload()
+    assert Image.open(upload.stream).format == 'MPO'
+
+
+def test_validate_image_accepts_mpo_jpeg(app):
+    assert validate_image(mpo_upload()) == (True, 'OK')
+
+
+def test_validate_image_rejects_non_image(app):
+    upload = FileStorage(stream=io.BytesIO(b'not an image'), filename='fake.jpg')
+    assert validate_image(upload) == (False, 'Файл не является изображением')
+
+
+def test_process_product_image_resizes_mpo(app, tmp_path):
+    success, filename = process_product_image(mpo_upload(), 'camera.jpg')
+    
+    assert success, filename
+    with Image.open(os.path.join(tmp_path, 'products', filename)) as image:
+        assert image.format == 'JPEG'
+        assert image.size[0] <= app.config['MAX_IMAGE_WIDTH']
+        assert image.size[1] <= app.config['MAX_IMAGE_HEIGHT']
+    with Image.open(os.path.join(tmp_path, 'products', 'thumbnails', filename)) as thumbnail:
+        assert max(thumbnail.size) <= max(app.config['THUMBNAIL_SIZE'])
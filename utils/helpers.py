@@ -3,32 +3,94 @@ Helper utilities for POS system
 """
 import os
 import secrets
-import string
 import uuid
-import imghdr
 from datetime import datetime
 from functools import wraps
-from flask import session, request, flash, redirect, url_for, current_app
+from flask import g, session, request, flash, redirect, url_for, current_app
 from flask_login import current_user
 from werkzeug.utils import secure_filename
 from PIL import Image, ImageOps
-from models import db, OperationLog, UserRole
+from sqlalchemy import func, cast, or_, select, lambda_stmt
+from models import db, OperationLog, PromoCode, UserRole, transaction_number_seq, order_number_seq
 
 
 def generate_transaction_number():
     """Generate unique transaction number"""
+    if db.engine.dialect.name == 'postgresql':
+        return database_generated_number('TXN', transaction_number_seq)
     timestamp = datetime.now().strftime('%Y%m%d')
-    random_part = ''.join(secrets.choice(string.digits) for _ in range(4))
+    random_part = f"{secrets.randbelow(10000):04d}"
     return f"TXN{timestamp}{random_part}"
 
 
 def generate_order_number():
     """Generate unique purchase order number"""
+    if db.engine.dialect.name == 'postgresql':
+        return database_generated_number('PO', order_number_seq)
     timestamp = datetime.now().strftime('%Y%m%d')
-    random_part = ''.join(secrets.choice(string.digits) for _ in range(4))
+    random_part = f"{secrets.randbelow(10000):04d}"
     return f"PO{timestamp}{random_part}"
 
 
+def database_generated_number(prefix, sequence):
+    """SQL expression building '<prefix><YYYYMMDD><6-digit counter>' inside the INSERT itself"""
+    # Assigned to the model attribute, it is evaluated by PostgreSQL and returned with the new row,
+    # so numbers never collide and need no extra round trip
+    return func.concat(
+        prefix,
+        func.to_char(func.now(), 'YYYYMMDD'),
+        func.lpad(cast(sequence.next_value(), db.String), 6, '0')
+    )
+
+
+def find_usable_promo_code(code, now):
+    """Active promo code inside its date window with uses left, or None"""
+    # lambda_stmt builds and caches the statement once; code and now become bound parameters
+    stmt = lambda_stmt(lambda: select(PromoCode).where(
+        func.upper(PromoCode.code) == code,
+        PromoCode.is_active == True,
+        or_(PromoCode.start_date.is_(None), PromoCode.start_date <= now),
+        or_(PromoCode.end_date.is_(None), PromoCode.end_date >= now),
+        or_(func.coalesce(PromoCode.max_uses, 0) == 0, PromoCode.current_uses < PromoCode.max_uses)
+    ))
+    return db.session.execute(stmt).scalar()
+
+
+def promo_code_rejection(code, now):
+    """Explain why find_usable_promo_code found nothing: (error message, status code)"""
+    promo = PromoCode.query.filter(func.upper(PromoCode.code) == code, PromoCode.is_active == True).first()
+    if not promo:
+        return 'Промокод не найден или не активен', 404
+    if promo.start_date and promo.start_date > now:
+        return 'Промокод еще не активен', 400
+    if promo.end_date and promo.end_date < now:
+        return 'Промокод истек', 400
+    return 'Промокод исчерпан', 400
+
+
+def password_has_required_characters(password):
+    """True if the password has an uppercase letter, a lowercase letter and a digit"""
+    # Single pass shared by user registration and the default admin account check
+    has_upper = has_lower = has_digit = False
+    for c in password:
+        if c.isupper():
+            has_upper = True
+        elif c.islower():
+            has_lower = True
+        elif c.isdigit():
+            has_digit = True
+        if has_upper and has_lower and has_digit:
+            return True
+    return False
+
+
+def log_values_json(values):
+    """Serialize logged values with the app's orjson JSON provider"""
+    if not values or isinstance(values, str):
+        return values or None
+    return current_app.json.dumps(values)
+
+
 def log_operation(action, description=None, entity_type=None, entity_id=None, old_values=None, new_values=None):
     """Log user operations"""
     if current_user.is_authenticated:
@@ -38,13 +100,28 @@ def log_operation(action, description=None, entity_type=None, entity_id=None, ol
         log.description = description
         log.entity_type = entity_type
         log.entity_id = entity_id
-        log.old_values = old_values
-        log.new_values = new_values
+        log.old_values = log_values_json(old_values)
+        log.new_values = log_values_json(new_values)
         log.ip_address = request.remote_addr
         log.user_agent = request.user_agent.string
         
-        db.session.add(log)
-        db.session.commit()
+        # Written together with the request's other entries by flush_pending_logs
+        g.setdefault('pending_logs', []).append(log)
+
+
+def flush_pending_logs(response):
+    """Write the operation logs collected during a request in one commit"""
+    pending_logs = g.pop('pending_logs', None)
+    # Error responses (including those from the app's error handlers) rolled their work back,
+    # so their entries would describe changes that never happened
+    if pending_logs and response.status_code < 400:
+        try:
+            db.session.add_all(pending_logs)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('Failed to log operations')
+    return response
 
 
 def require_role(required_role):
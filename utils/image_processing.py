@@ -3,11 +3,13 @@ Image processing utilities for POS system
 """
 import os
 import uuid
-import imghdr
 from flask import current_app
 from werkzeug.utils import secure_filename
 from PIL import Image, ImageOps
 
+# Upload directories already created by this process; they only live under UPLOAD_FOLDER
+ENSURED_DIRS = set()
+
 
 def allowed_file(filename):
     """Check if uploaded file has allowed extension"""
@@ -23,18 +25,32 @@ def validate_image(file):
     if not allowed_file(file.filename):
         return False, 'Недопустимый тип файла. Разрешены: PNG, JPG, JPEG, GIF'
     
-    # Check file content type
-    file.seek(0)
-    header = file.read(512)
-    file.seek(0)
+    # Check file content: Pillow detects the format from the magic bytes and verify()
+    # checks the file structure without decoding the pixels
+    try:
+        file.seek(0)
+        image = Image.open(file)
+        image_format = (image.format or '').lower()
+        image.verify()
+    except Exception:
+        return False, 'Файл не является изображением'
+    finally:
+        file.seek(0)
     
-    format = imghdr.what(None, header)
-    if not format or format not in ['jpeg', 'png', 'gif']:
+    # Phone cameras write JPEGs with an MPF marker, which Pillow reports as MPO
+    if image_format not in ('jpeg', 'mpo', 'png', 'gif'):
         return False, 'Файл не является изображением'
     
     return True, 'OK'
 
 
+def ensure_directory(path):
+    """Create a directory once per process instead of on every upload"""
+    if path not in ENSURED_DIRS:
+        os.makedirs(path, exist_ok=True)
+        ENSURED_DIRS.add(path)
+
+
 def generate_unique_filename(original_filename):
     """Generate unique filename for uploaded image (normalized to .jpg)"""
     unique_id = str(uuid.uuid4())[:8]
@@ -45,8 +61,13 @@ def generate_unique_filename(original_filename):
 def process_product_image(file, filename):
     """Process uploaded product image - resize and create thumbnail (all saved as JPEG)"""
     try:
-        # Open and process the image
+        max_size = (current_app.config['MAX_IMAGE_WIDTH'], current_app.config['MAX_IMAGE_HEIGHT'])
+        
+        # Open and process the image; JPEGs are decoded by libjpeg at a reduced scale
+        # (still at least twice the target size) instead of at full resolution
         image = Image.open(file)
+        if image.format in ('JPEG', 'MPO'):
+            image.draft('RGB', (max_size[0] * 2, max_size[1] * 2))
         
         # Convert RGBA to RGB if necessary
         if image.mode == 'RGBA':
@@ -60,20 +81,19 @@ def process_product_image(file, filename):
         image = ImageOps.exif_transpose(image)
         
         # Resize main image if it's too large
-        max_size = (current_app.config['MAX_IMAGE_WIDTH'], current_app.config['MAX_IMAGE_HEIGHT'])
         image.thumbnail(max_size, Image.Resampling.LANCZOS)
         
         # Save main image as JPEG (filename already has .jpg extension)
         main_image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'products', filename)
-        os.makedirs(os.path.dirname(main_image_path), exist_ok=True)
+        ensure_directory(os.path.dirname(main_image_path))
         image.save(main_image_path, 'JPEG', quality=85, optimize=True)
         
-        # Create and save thumbnail as JPEG
+        # Create and save thumbnail as JPEG; bilinear is enough when scaling down the already resized image
         thumbnail = image.copy()
-        thumbnail.thumbnail(current_app.config['THUMBNAIL_SIZE'], Image.Resampling.LANCZOS)
+        thumbnail.thumbnail(current_app.config['THUMBNAIL_SIZE'], Image.Resampling.BILINEAR)
         
         thumbnail_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'products', 'thumbnails', filename)
-        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+        ensure_directory(os.path.dirname(thumbnail_path))
         thumbnail.save(thumbnail_path, 'JPEG', quality=80, optimize=True)
         
         return True, filename
@@ -1,6 +1,7 @@
 """
 Language and translation utilities for POS system
 """
+from functools import lru_cache
 from flask import session
 
 
@@ -42,9 +43,16 @@ def get_text(kk_text, ru_text):
     return kk_text
 
 
-def translate_name(original_name, category='products'):
-    """Translate product/category name based on current language"""
+@lru_cache(maxsize=4096)
+def translate_for_language(original_name, category, language):
+    """Translate product/category name into the given language (memoized)"""
     translations = TRANSLATIONS.get(category, {})
     if original_name in translations:
-        return translations[original_name].get(get_language(), original_name)
-    return original_name
\ No newline at end of file
+        return translations[original_name].get(language, original_name)
+    return original_name
+
+
+def translate_name(original_name, category='products', language=None):
+    """Translate product/category name based on current language"""
+    # Loops over many rows should pass language=get_language() read once per request
+    return translate_for_language(original_name, category, language or get_language())
@@ -6,7 +6,7 @@ from datetime import datetime
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_user, logout_user, login_required, current_user
 from models import db, User, UserRole
-from utils.helpers import log_operation, require_role
+from utils.helpers import log_operation, require_role, password_has_required_characters
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -70,11 +70,7 @@ def register():
             return render_template('auth/register.html')
         
         # Additional password complexity check
-        has_upper = any(c.isupper() for c in password)
-        has_lower = any(c.islower() for c in password)
-        has_digit = any(c.isdigit() for c in password)
-        
-        if not (has_upper and has_lower and has_digit):
+        if not password_has_required_characters(password):
             flash('Құпия сөзде үлкен әріп, кіші әріп және сан болуы керек / Пароль должен содержать заглавные буквы, строчные буквы и цифры', 'error')
             return render_template('auth/register.html')
         
@@ -26,6 +26,8 @@ def clear_cache():
         cache_service.delete_pattern("popular_products:*")
         cache_service.delete_pattern("categories_with_counts")
         cache_service.delete_pattern("dashboard_stats:*")
+        cache_service.delete_pattern("sales_summary:*")
+        cache_service.invalidate_discount_rules()
         
         return jsonify({
             'success': True,
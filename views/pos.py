@@ -2,9 +2,12 @@ from flask import Blueprint, render_template, request, jsonify, session, current
 from flask_login import login_required, current_user
 from models import db, Product, Category, Transaction, TransactionItem, Payment, PromoCode, OperationLog
 from models import PaymentMethod, TransactionStatus, UnitType, UserRole
-from utils.helpers import log_operation, generate_transaction_number
+from utils.helpers import log_operation, generate_transaction_number, find_usable_promo_code, promo_code_rejection
 from utils.language import get_language, translate_name
-from sqlalchemy import or_, desc, func, and_
+from services.cache_service import cache_service
+from services.transaction_service import TransactionService
+from sqlalchemy import or_, desc, func, and_, case, cast, select, insert, update, delete, text, bindparam, literal
+from sqlalchemy.orm import selectinload, joinedload
 from decimal import Decimal
 from datetime import datetime, timedelta
 import json
@@ -21,22 +24,70 @@ popular_products_cache = {
     'entries': {}  # Структура: {'key': {'data': [...], 'timestamp': time.time()}}
 }
 
+# Decimal constants for totals arithmetic, parsed once
+ZERO_AMOUNT = Decimal('0.00')
+VAT_RATE = Decimal('0.12')  # 12% VAT (Kazakhstan rate)
+
 # Helper functions
 
 
 
+def items_subtotal(transaction_id):
+    """SQL expression summing item totals net of item discounts for a transaction"""
+    return select(
+        func.coalesce(func.sum(TransactionItem.total_price - func.coalesce(TransactionItem.discount_amount, 0)), 0)
+    ).where(TransactionItem.transaction_id == transaction_id)
+
 def update_transaction_totals(transaction):
-    """Update transaction totals based on items"""
-    # Ensure all values are Decimal for proper arithmetic
-    subtotal = Decimal('0.00')
-    for item in transaction.items:
-        item_total = item.total_price or Decimal('0.00')
-        item_discount = item.discount_amount or Decimal('0.00')
-        subtotal += (item_total - item_discount)
-    
+    """Recalculate transaction totals from its items (used to reconcile on complete)"""
+    # Summed by the database, so the items collection doesn't have to be loaded
+    transaction.subtotal = Decimal(db.session.execute(items_subtotal(transaction.id)).scalar())
+    apply_subtotal_change(transaction, ZERO_AMOUNT)
+
+def transaction_totals_values(subtotal):
+    """Column values for an UPDATE of transaction totals from a subtotal SQL expression"""
+    tax_amount = subtotal * VAT_RATE
+    return {
+        'subtotal': subtotal,
+        'tax_amount': tax_amount,
+        'total_amount': subtotal + tax_amount - func.coalesce(Transaction.discount_amount, 0)
+    }
+
+def adjust_pending_transaction_totals(transaction_id, delta):
+    """Apply a subtotal change to a pending transaction in one UPDATE; returns the new total or None if not pending"""
+    # The status check and the totals update share a statement, so cart edits need no SELECT of the transaction
+    return db.session.execute(
+        update(Transaction)
+        .where(Transaction.id == transaction_id, Transaction.status == TransactionStatus.PENDING)
+        .values(**transaction_totals_values(func.coalesce(Transaction.subtotal, 0) + delta))
+        .returning(Transaction.total_amount)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+def recalculate_transaction_totals(transaction_id):
+    """Recompute transaction totals from its items inside the database, without loading the items"""
+    db.session.execute(
+        update(Transaction)
+        .where(Transaction.id == transaction_id)
+        .values(**transaction_totals_values(items_subtotal(transaction_id).scalar_subquery()))
+        .execution_options(synchronize_session=False)
+    )
+
+def apply_subtotal_change(transaction, delta):
+    """Adjust the running subtotal by delta and recompute tax and total without loading items"""
+    subtotal = (transaction.subtotal or ZERO_AMOUNT) + delta
     transaction.subtotal = subtotal
-    transaction.tax_amount = subtotal * Decimal('0.12')  # 12% VAT (Kazakhstan rate)
-    transaction.total_amount = subtotal + transaction.tax_amount - (transaction.discount_amount or Decimal('0.00'))
+    transaction.tax_amount = subtotal * VAT_RATE
+    transaction.total_amount = subtotal + transaction.tax_amount - (transaction.discount_amount or ZERO_AMOUNT)
+
+def defer_cart_commit_flush():
+    """Let the commit of a pending-cart edit return without waiting for the WAL flush.
+    
+    Cart edits are cheap to redo if the last few milliseconds are lost in a crash;
+    completing a sale still commits with full durability. PostgreSQL only.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text('SET LOCAL synchronous_commit TO OFF'))
 
 # Routes
 
@@ -46,10 +97,42 @@ def pos():
     """POS Terminal Interface"""
     categories = Category.query.all()
     # Translate category names for current language
+    language = get_language()
     for category in categories:
-        category.translated_name = translate_name(category.name, 'categories')
+        category.translated_name = translate_name(category.name, 'categories', language)
     return render_template('pos.html', categories=categories)
 
+def build_product_search_statement(by_text, by_category):
+    """Core select of only the columns the product search response needs, with bound filter values"""
+    statement = select(
+        Product.id,
+        Product.sku,
+        Product.name,
+        Product.price,
+        Product.stock_quantity,
+        Product.unit_type,
+        Product.image_filename
+    ).where(Product.is_active == True)
+    
+    if by_text:
+        statement = statement.where(
+            or_(
+                Product.name.ilike(bindparam('pattern')),
+                Product.sku.ilike(bindparam('pattern'))
+            )
+        )
+    
+    if by_category:
+        statement = statement.where(Product.category_id == bindparam('category_id', type_=db.Integer))
+    
+    return statement.limit(10)
+
+PRODUCT_SEARCH_STATEMENTS = {
+    (by_text, by_category): build_product_search_statement(by_text, by_category)
+    for by_text in (True, False)
+    for by_category in (True, False)
+}
+
 @pos_bp.route('/api/products/search')
 @login_required
 def search_products():
@@ -60,29 +143,24 @@ def search_products():
     if len(query) < 2 and not category_id:
         return jsonify([])
     
-    # Build search query
-    search_query = Product.query.filter_by(is_active=True)
-    
+    # Statements are prebuilt per filter combination; only the bound values change per request
+    search_query = PRODUCT_SEARCH_STATEMENTS[(bool(query), bool(category_id))]
+    params = {}
     if query:
-        search_query = search_query.filter(
-            or_(
-                Product.name.ilike(f'%{query}%'),
-                Product.sku.ilike(f'%{query}%')
-            )
-        )
-    
+        params['pattern'] = f'%{query}%'
     if category_id:
-        search_query = search_query.filter_by(category_id=category_id)
+        params['category_id'] = category_id
     
-    products = search_query.limit(10).all()
+    products = db.session.execute(search_query, params).all()
     
+    language = get_language()
     return jsonify([{
         'id': p.id,
         'sku': p.sku,
-        'name': translate_name(p.name, 'products'),
+        'name': translate_name(p.name, 'products', language),
         'price': float(p.price),
         'stock_quantity': p.stock_quantity,
-        'unit_type': translate_name(p.unit_type.value, 'units'),
+        'unit_type': translate_name(p.unit_type.value, 'units', language),
         'image_filename': p.image_filename
     } for p in products])
 
@@ -106,18 +184,19 @@ def search_barcode():
         product = Product.query.filter_by(sku=barcode, is_active=True).first()
     
     if product:
+        language = get_language()
         return jsonify({
             'success': True,
             'product': {
                 'id': product.id,
                 'sku': product.sku,
                 'barcode': product.barcode,
-                'name': translate_name(product.name, 'products'),
+                'name': translate_name(product.name, 'products', language),
                 'price': float(product.price),
                 'stock_quantity': product.stock_quantity,
-                'unit_type': translate_name(product.unit_type.value, 'units'),
+                'unit_type': translate_name(product.unit_type.value, 'units', language),
                 'image_filename': product.image_filename,
-                'category_name': translate_name(product.category.name, 'categories') if product.category else None,
+                'category_name': translate_name(product.category.name, 'categories', language) if product.category else None,
                 'supplier_name': product.supplier.name if product.supplier else None
             }
         })
@@ -170,15 +249,16 @@ def get_cached_popular_products(limit=10, days=30):
     popular_products = popular_products_query.all()
     
     # Форматируем данные
+    language = get_language()
     products_data = []
     for product in popular_products:
         products_data.append({
             'id': product.id,
-            'name': translate_name(product.name, 'products'),
+            'name': translate_name(product.name, 'products', language),
             'sku': product.sku,
             'price': float(product.price),
             'stock_quantity': product.stock_quantity,
-            'unit_type': translate_name(product.unit_type.value, 'units'),
+            'unit_type': translate_name(product.unit_type.value, 'units', language),
             'image_filename': product.image_filename,
             'popularity_stats': {
                 'transaction_count': product.transaction_count,
@@ -260,6 +340,7 @@ def get_low_stock_alerts():
             Product.stock_quantity <= func.coalesce(func.nullif(Product.min_stock_level, 0), 5)
         ).order_by(Product.stock_quantity.asc()).all()
         
+        language = get_language()
         alerts = []
         for row in low_stock_query:
             min_level = row.min_stock_level or 5
@@ -276,22 +357,22 @@ def get_low_stock_alerts():
             
             # Локализованные сообщения
             if severity == 'critical':
-                localized_message = translate_name('Товар закончился', 'alerts') 
+                localized_message = translate_name('Товар закончился', 'alerts', language) 
             elif severity == 'high':
-                localized_message = translate_name('Критически низкий остаток', 'alerts')
+                localized_message = translate_name('Критически низкий остаток', 'alerts', language)
             else:
-                localized_message = translate_name('Низкий остаток товара', 'alerts')
+                localized_message = translate_name('Низкий остаток товара', 'alerts', language)
             
             alerts.append({
                 'product_id': row.id,
-                'product_name': translate_name(row.name, 'products'),
+                'product_name': translate_name(row.name, 'products', language),
                 'sku': row.sku,
                 'current_stock': row.stock_quantity,
                 'min_stock_level': min_level,
                 'severity': severity,
                 'message': localized_message,
-                'category': translate_name(row.category_name, 'categories') if row.category_name else translate_name('Без категории', 'general'),
-                'unit_type': translate_name(row.unit_type.value, 'units') if row.unit_type else translate_name('шт.', 'units')
+                'category': translate_name(row.category_name, 'categories', language) if row.category_name else translate_name('Без категории', 'general', language),
+                'unit_type': translate_name(row.unit_type.value, 'units', language) if row.unit_type else translate_name('шт.', 'units', language)
             })
         
         return jsonify({
@@ -373,15 +454,16 @@ def get_quick_access_products():
         ).limit(8).all()  # Limit to 8 for quick access panel
         
         # Format response
+        language = get_language()
         products_data = []
         for product in quick_access_products:
             products_data.append({
                 'id': product.id,
-                'name': translate_name(product.name, 'products'),
+                'name': translate_name(product.name, 'products', language),
                 'sku': product.sku,
                 'price': float(product.price),
                 'stock_quantity': product.stock_quantity,
-                'unit_type': translate_name(product.unit_type.value, 'units'),
+                'unit_type': translate_name(product.unit_type.value, 'units', language),
                 'image_filename': product.image_filename,
                 'recent_sales': product.recent_sales or 0,
                 'overall_sales': product.overall_sales
@@ -406,91 +488,91 @@ def get_quick_access_products():
 @login_required
 def start_transaction():
     """Start a new transaction"""
-    try:
-        data = request.get_json() or {}
-        cashier_name = data.get('cashier_name', 'Кассир')
-        customer_name = data.get('customer_name', '')
-        
-        transaction = Transaction(  # type: ignore
+    data = request.get_json() or {}
+    cashier_name = data.get('cashier_name', 'Кассир')
+    customer_name = data.get('customer_name', '')
+    
+    # Single INSERT ... RETURNING; no ORM instance to flush and refresh after commit
+    transaction = db.session.execute(
+        insert(Transaction).values(
             transaction_number=generate_transaction_number(),
             status=TransactionStatus.PENDING,
             cashier_name=cashier_name,
             customer_name=customer_name,
             user_id=current_user.id
-        )
-        
-        db.session.add(transaction)
-        db.session.commit()
-        
-        # Store transaction ID in session
-        session['current_transaction_id'] = transaction.id
-        
-        return jsonify({
-            'success': True,
-            'transaction_id': transaction.id,
-            'transaction_number': transaction.transaction_number
-        })
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 500
+        ).returning(Transaction.id, Transaction.transaction_number)
+    ).one()
+    db.session.commit()
+    
+    # Store transaction ID in session
+    session['current_transaction_id'] = transaction.id
+    
+    return jsonify({
+        'success': True,
+        'transaction_id': transaction.id,
+        'transaction_number': transaction.transaction_number
+    })
 
 @pos_bp.route('/api/transaction/add_item', methods=['POST'])
 def add_item_to_transaction():
     """Add item to current transaction"""
-    try:
-        data = request.get_json() or {}
-        transaction_id = session.get('current_transaction_id')
-        
-        if not transaction_id:
-            return jsonify({'success': False, 'error': 'Нет активной транзакции'}), 400
-        
-        transaction = Transaction.query.get(transaction_id)
-        if not transaction or transaction.status != TransactionStatus.PENDING:
-            return jsonify({'success': False, 'error': 'Транзакция недоступна'}), 400
-        
-        product = Product.query.get(data['product_id'])
-        if not product:
-            return jsonify({'success': False, 'error': 'Товар не найден'}), 404
-        
-        quantity = Decimal(str(data['quantity']))
-        if quantity <= 0:
-            return jsonify({'success': False, 'error': 'Неверное количество'}), 400
-        
-        # Check stock
-        if product.stock_quantity < float(quantity):
-            return jsonify({'success': False, 'error': 'Недостаточно товара на складе'}), 400
-        
-        # Create new item
-        item = TransactionItem(  # type: ignore
-            transaction_id=transaction_id,
-            product_id=product.id,
-            quantity=quantity,
-            unit_price=product.price,
-            total_price=quantity * product.price,
-            discount_amount=Decimal('0.00')
-        )
-        db.session.add(item)
-        
-        # Update transaction totals
-        update_transaction_totals(transaction)
-        
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'item': {
-                'product_name': product.name,
-                'quantity': quantity,
-                'unit_price': float(product.price),
-                'total_price': float(quantity * product.price)
-            },
-            'transaction_total': float(transaction.total_amount)
-        })
-        
-    except Exception as e:
+    data = request.get_json() or {}
+    transaction_id = session.get('current_transaction_id')
+    
+    if not transaction_id:
+        return jsonify({'success': False, 'error': 'Нет активной транзакции'}), 400
+    
+    # Product fields come from the Redis lookaside cache when available
+    product = cache_service.get_product_snapshot(int(data['product_id']))
+    if not product:
+        return jsonify({'success': False, 'error': 'Товар не найден'}), 404
+    price = Decimal(product['price'])
+    
+    quantity = Decimal(str(data['quantity']))
+    if quantity <= 0:
+        return jsonify({'success': False, 'error': 'Неверное количество'}), 400
+    
+    # Check stock
+    if product['stock_quantity'] < quantity:
+        return jsonify({'success': False, 'error': 'Недостаточно товара на складе'}), 400
+    
+    # Update transaction totals incrementally before the INSERT; this also verifies the
+    # transaction still exists and is pending, so a stale session id never reaches the FK.
+    # The line total is cast like the generated total_price column, so both round alike.
+    line_total = cast(
+        literal(quantity, db.Numeric(10, 3)) * literal(price, db.Numeric(10, 2)), db.Numeric(10, 2)
+    )
+    transaction_total = adjust_pending_transaction_totals(transaction_id, line_total)
+    if transaction_total is None:
         db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return jsonify({'success': False, 'error': 'Транзакция недоступна'}), 400
+    
+    # Create new item
+    item = TransactionItem(  # type: ignore
+        transaction_id=transaction_id,
+        product_id=product['id'],
+        quantity=quantity,
+        unit_price=price,
+        unit_cost=Decimal(product['cost_price']),
+        discount_amount=ZERO_AMOUNT
+    )
+    db.session.add(item)
+    # total_price is generated by the database and returned by the INSERT
+    db.session.flush()
+    
+    defer_cart_commit_flush()
+    db.session.commit()
+    
+    return jsonify({
+        'success': True,
+        'item': {
+            'product_name': product['name'],
+            'quantity': quantity,
+            'unit_price': float(price),
+            'total_price': float(item.total_price)
+        },
+        'transaction_total': float(transaction_total)
+    })
 
 @pos_bp.route('/api/transaction/current')
 @login_required
@@ -501,7 +583,11 @@ def get_current_transaction():
     if not transaction_id:
         return jsonify({'success': False, 'error': 'Нет активной транзакции'})
     
-    transaction = Transaction.query.get(transaction_id)
+    # Load items and their products up front to avoid a SELECT per line item
+    transaction = db.session.get(
+        Transaction, transaction_id,
+        options=[selectinload(Transaction.items).joinedload(TransactionItem.product)]
+    )
     if not transaction:
         return jsonify({'success': False, 'error': 'Транзакция не найдена'})
     
@@ -533,379 +619,352 @@ def get_current_transaction():
 @pos_bp.route('/api/transaction/complete', methods=['POST'])
 def complete_transaction():
     """Complete transaction with payments"""
+    data = request.get_json() or {}
+    transaction_id = session.get('current_transaction_id')
+    
+    if not transaction_id:
+        return jsonify({'success': False, 'error': 'Нет активной транзакции'}), 400
+    
+    transaction = db.session.get(
+        Transaction, transaction_id,
+        options=[selectinload(Transaction.items).joinedload(TransactionItem.product)]
+    )
+    if not transaction or transaction.status != TransactionStatus.PENDING:
+        return jsonify({'success': False, 'error': 'Транзакция недоступна'}), 400
+    
+    payments = data.get('payments', [])
+    if not payments:
+        return jsonify({'success': False, 'error': 'Не указаны способы оплаты'}), 400
+    
+    # Reconcile the running totals with the items before taking payment
+    update_transaction_totals(transaction)
+    
+    # Parse payment amounts once at the API boundary
+    payment_amounts = [Decimal(str(p['amount'])) for p in payments]
+    
+    # Validate payment amounts
+    total_payment = sum(payment_amounts)
+    if abs(total_payment - transaction.total_amount) > Decimal('0.01'):
+        return jsonify({'success': False, 'error': 'Сумма оплаты не совпадает с общей суммой'}), 400
+    
+    # Create payment records
+    for payment_data, amount in zip(payments, payment_amounts):
+        payment = Payment(  # type: ignore
+            transaction_id=transaction.id,
+            method=PaymentMethod(payment_data['method']),
+            amount=amount,
+            reference_number=payment_data.get('reference_number')
+        )
+        db.session.add(payment)
+    
+    # Quantities sold per product
+    sold_items = [(item.product_id, item.product.name, int(item.quantity)) for item in transaction.items]
+    stock_deltas = {}
+    for product_id, _, quantity in sold_items:
+        stock_deltas[product_id] = stock_deltas.get(product_id, 0) + quantity
+    
+    # Stock and promo use go through TransactionService, the one guarded path for every checkout;
+    # either failing rolls the sale back
     try:
-        data = request.get_json() or {}
-        transaction_id = session.get('current_transaction_id')
-        
-        if not transaction_id:
-            return jsonify({'success': False, 'error': 'Нет активной транзакции'}), 400
-        
-        transaction = Transaction.query.get(transaction_id)
-        if not transaction or transaction.status != TransactionStatus.PENDING:
-            return jsonify({'success': False, 'error': 'Транзакция недоступна'}), 400
-        
-        payments = data.get('payments', [])
-        if not payments:
-            return jsonify({'success': False, 'error': 'Не указаны способы оплаты'}), 400
-        
-        # Validate payment amounts
-        total_payment = sum(Decimal(str(p['amount'])) for p in payments)
-        if abs(total_payment - transaction.total_amount) > Decimal('0.01'):
-            return jsonify({'success': False, 'error': 'Сумма оплаты не совпадает с общей суммой'}), 400
-        
-        # Create payment records
-        for payment_data in payments:
-            payment = Payment(  # type: ignore
-                transaction_id=transaction.id,
-                method=PaymentMethod(payment_data['method']),
-                amount=Decimal(str(payment_data['amount'])),
-                reference_number=payment_data.get('reference_number')
-            )
-            db.session.add(payment)
-        
-        # Update stock quantities
-        for item in transaction.items:
-            item.product.stock_quantity -= int(item.quantity)
-        
-        # Handle promo code usage increment atomically if promo code was used
-        if transaction.promo_code_used:
-            promo = db.session.query(PromoCode).filter(
-                func.upper(PromoCode.code) == transaction.promo_code_used.upper(),
-                PromoCode.is_active == True
-            ).with_for_update().first()
-            
-            if promo:
-                # Final validation before incrementing usage
-                if promo.max_uses and promo.current_uses >= promo.max_uses:
-                    # This should not happen if validation was done correctly earlier
-                    db.session.rollback()
-                    return jsonify({'success': False, 'error': 'Промокод исчерпан на момент завершения транзакции'}), 400
-                
-                promo.current_uses += 1
-        
-        # Complete transaction
-        transaction.status = TransactionStatus.COMPLETED
-        transaction.completed_at = datetime.utcnow()
-        transaction.user_id = current_user.id if current_user.is_authenticated else None
-        
-        db.session.commit()
-        
-        # Очищаем кеш популярных товаров после успешной продажи
-        clear_popular_products_cache()
-        
-        # Log the completed sale
+        new_stock = TransactionService.decrement_sold_stock(stock_deltas)
+        TransactionService.count_promo_code_use(transaction)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    # Complete transaction; shared with TransactionService so the sales rollups and caches stay in step
+    TransactionService.finalize_completed_sale(transaction, stock_deltas)
+    
+    # Очищаем кеш популярных товаров этого процесса после успешной продажи
+    clear_popular_products_cache()
+    
+    # Log the completed sale
+    log_operation(
+        'sale_completed',
+        f'Transaction {transaction.transaction_number} completed for ₸{transaction.total_amount}',
+        'transaction',
+        transaction.id,
+        None,
+        {
+            'transaction_number': transaction.transaction_number,
+            'total_amount': float(transaction.total_amount),
+            'items_count': len(sold_items),
+            'payment_methods': [p['method'] for p in payments]
+        }
+    )
+    
+    # Log inventory updates
+    for product_id, product_name, quantity in sold_items:
         log_operation(
-            'sale_completed',
-            f'Transaction {transaction.transaction_number} completed for ₸{transaction.total_amount}',
-            'transaction',
-            transaction.id,
-            None,
-            {
-                'transaction_number': transaction.transaction_number,
-                'total_amount': float(transaction.total_amount),
-                'items_count': len(transaction.items),
-                'payment_methods': [p['method'] for p in payments]
-            }
+            'inventory_update',
+            f'Stock reduced for {product_name}: -{quantity} units',
+            'product',
+            product_id,
+            {'stock_quantity': new_stock[product_id] + quantity},
+            {'stock_quantity': new_stock[product_id]}
         )
-        
-        # Log inventory updates
-        for item in transaction.items:
-            log_operation(
-                'inventory_update',
-                f'Stock reduced for {item.product.name}: -{int(item.quantity)} units',
-                'product',
-                item.product.id,
-                {'stock_quantity': item.product.stock_quantity + int(item.quantity)},
-                {'stock_quantity': item.product.stock_quantity}
-            )
-        
-        # Clear current transaction from session
-        session.pop('current_transaction_id', None)
-        
-        return jsonify({
-            'success': True,
-            'transaction_number': transaction.transaction_number,
-            'total_amount': float(transaction.total_amount)
-        })
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    # Clear current transaction from session
+    session.pop('current_transaction_id', None)
+    
+    return jsonify({
+        'success': True,
+        'transaction_number': transaction.transaction_number,
+        'total_amount': float(transaction.total_amount)
+    })
 
 @pos_bp.route('/api/transaction/suspend', methods=['POST'])
 def suspend_transaction():
     """Suspend current transaction"""
-    try:
-        transaction_id = session.get('current_transaction_id')
-        
-        if not transaction_id:
-            return jsonify({'success': False, 'error': 'Нет активной транзакции'}), 400
-        
-        transaction = Transaction.query.get(transaction_id)
-        if not transaction:
-            return jsonify({'success': False, 'error': 'Транзакция не найдена'}), 400
-        
-        transaction.status = TransactionStatus.SUSPENDED
-        db.session.commit()
-        
-        # Clear current transaction from session
-        session.pop('current_transaction_id', None)
-        
-        return jsonify({
-            'success': True,
-            'message': f'Чек {transaction.transaction_number} отложен'
-        })
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 500
+    transaction_id = session.get('current_transaction_id')
+    
+    if not transaction_id:
+        return jsonify({'success': False, 'error': 'Нет активной транзакции'}), 400
+    
+    transaction = db.session.get(Transaction, transaction_id)
+    if not transaction:
+        return jsonify({'success': False, 'error': 'Транзакция не найдена'}), 400
+    
+    recalculate_transaction_totals(transaction.id)
+    transaction.status = TransactionStatus.SUSPENDED
+    db.session.commit()
+    
+    # Clear current transaction from session
+    session.pop('current_transaction_id', None)
+    
+    return jsonify({
+        'success': True,
+        'message': f'Чек {transaction.transaction_number} отложен'
+    })
 
 @pos_bp.route('/api/suspended_transactions', methods=['GET'])
 @login_required
 def get_suspended_transactions():
     """Get list of suspended transactions for current user"""
-    try:
-        suspended_transactions = Transaction.query.filter_by(
-            status=TransactionStatus.SUSPENDED,
-            user_id=current_user.id
-        ).order_by(Transaction.created_at.desc()).all()
-        
-        transactions_data = []
-        for transaction in suspended_transactions:
-            items_count = len(transaction.items)
-            transactions_data.append({
-                'id': transaction.id,
-                'transaction_number': transaction.transaction_number,
-                'created_at': transaction.created_at.strftime('%d.%m.%Y %H:%M'),
-                'cashier_name': transaction.cashier_name or 'Кассир',
-                'customer_name': transaction.customer_name or '',
-                'total_amount': float(transaction.total_amount),
-                'items_count': items_count
-            })
-        
-        return jsonify({
-            'success': True,
-            'transactions': transactions_data
+    # Items are loaded in one extra query for all transactions instead of one per transaction
+    suspended_transactions = Transaction.query.options(
+        selectinload(Transaction.items)
+    ).filter_by(
+        status=TransactionStatus.SUSPENDED,
+        user_id=current_user.id
+    ).order_by(Transaction.created_at.desc()).all()
+    
+    transactions_data = []
+    for transaction in suspended_transactions:
+        items_count = len(transaction.items)
+        transactions_data.append({
+            'id': transaction.id,
+            'transaction_number': transaction.transaction_number,
+            'created_at': transaction.created_at.strftime('%d.%m.%Y %H:%M'),
+            'cashier_name': transaction.cashier_name or 'Кассир',
+            'customer_name': transaction.customer_name or '',
+            'total_amount': float(transaction.total_amount),
+            'items_count': items_count
         })
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    return jsonify({
+        'success': True,
+        'transactions': transactions_data
+    })
 
 @pos_bp.route('/api/transaction/restore', methods=['POST'])
 @login_required
 def restore_transaction():
     """Restore suspended transaction"""
-    try:
-        data = request.get_json() or {}
-        transaction_id = data.get('transaction_id')
-        
-        if not transaction_id:
-            return jsonify({'success': False, 'error': 'Не указан ID транзакции'}), 400
-        
-        # Check if there's already an active transaction
-        current_transaction_id = session.get('current_transaction_id')
-        if current_transaction_id:
-            current_transaction = Transaction.query.get(current_transaction_id)
-            if current_transaction and current_transaction.status == TransactionStatus.PENDING:
-                return jsonify({
-                    'success': False, 
-                    'error': 'Завершите или отложите текущую транзакцию перед восстановлением'
-                }), 400
-        
-        transaction = Transaction.query.filter_by(
-            id=transaction_id,
-            user_id=current_user.id
-        ).first()
-        if not transaction:
-            return jsonify({'success': False, 'error': 'Транзакция не найдена или не принадлежит вам'}), 404
-        
-        if transaction.status != TransactionStatus.SUSPENDED:
-            return jsonify({'success': False, 'error': 'Транзакция не отложена'}), 400
-        
-        # Restore transaction
-        transaction.status = TransactionStatus.PENDING
-        db.session.commit()
-        
-        # Set as current transaction
-        session['current_transaction_id'] = transaction.id
-        
-        return jsonify({
-            'success': True,
-            'message': f'Чек {transaction.transaction_number} восстановлен',
-            'transaction_id': transaction.id,
-            'transaction_number': transaction.transaction_number
-        })
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 500
+    data = request.get_json() or {}
+    transaction_id = data.get('transaction_id')
+    
+    if not transaction_id:
+        return jsonify({'success': False, 'error': 'Не указан ID транзакции'}), 400
+    
+    # Check if there's already an active transaction
+    current_transaction_id = session.get('current_transaction_id')
+    if current_transaction_id:
+        current_transaction = db.session.get(Transaction, current_transaction_id)
+        if current_transaction and current_transaction.status == TransactionStatus.PENDING:
+            return jsonify({
+                'success': False, 
+                'error': 'Завершите или отложите текущую транзакцию перед восстановлением'
+            }), 400
+    
+    transaction = Transaction.query.filter_by(
+        id=transaction_id,
+        user_id=current_user.id
+    ).first()
+    if not transaction:
+        return jsonify({'success': False, 'error': 'Транзакция не найдена или не принадлежит вам'}), 404
+    
+    if transaction.status != TransactionStatus.SUSPENDED:
+        return jsonify({'success': False, 'error': 'Транзакция не отложена'}), 400
+    
+    # Restore transaction
+    transaction.status = TransactionStatus.PENDING
+    db.session.commit()
+    
+    # Set as current transaction
+    session['current_transaction_id'] = transaction.id
+    
+    return jsonify({
+        'success': True,
+        'message': f'Чек {transaction.transaction_number} восстановлен',
+        'transaction_id': transaction.id,
+        'transaction_number': transaction.transaction_number
+    })
 
 @pos_bp.route('/api/transaction/remove_item', methods=['POST'])
 def remove_item_from_transaction():
     """Remove item from current transaction"""
-    try:
-        data = request.get_json() or {}
-        transaction_id = session.get('current_transaction_id')
-        
-        if not transaction_id:
-            return jsonify({'success': False, 'error': 'Нет активной транзакции'}), 400
-        
-        item_id = data.get('item_id')
-        if not item_id:
-            return jsonify({'success': False, 'error': 'Не указан ID товара'}), 400
-        
-        item = TransactionItem.query.filter_by(
-            id=item_id, 
-            transaction_id=transaction_id
-        ).first()
-        
-        if not item:
-            return jsonify({'success': False, 'error': 'Товар не найден в корзине'}), 404
-        
-        transaction = item.transaction
-        db.session.delete(item)
-        
-        # Update transaction totals
-        update_transaction_totals(transaction)
-        
-        db.session.commit()
-        
-        return jsonify({
-            'success': True,
-            'transaction_total': float(transaction.total_amount)
-        })
-        
-    except Exception as e:
+    data = request.get_json() or {}
+    transaction_id = session.get('current_transaction_id')
+    
+    if not transaction_id:
+        return jsonify({'success': False, 'error': 'Нет активной транзакции'}), 400
+    
+    item_id = data.get('item_id')
+    if not item_id:
+        return jsonify({'success': False, 'error': 'Не указан ID товара'}), 400
+    
+    item = db.session.execute(
+        delete(TransactionItem)
+        .where(TransactionItem.id == item_id, TransactionItem.transaction_id == transaction_id)
+        .returning(TransactionItem.total_price, TransactionItem.discount_amount)
+        .execution_options(synchronize_session=False)
+    ).first()
+    
+    if not item:
+        return jsonify({'success': False, 'error': 'Товар не найден в корзине'}), 404
+    
+    # Update transaction totals incrementally; this also verifies the transaction is still pending
+    transaction_total = adjust_pending_transaction_totals(
+        transaction_id,
+        -((item.total_price or ZERO_AMOUNT) - (item.discount_amount or ZERO_AMOUNT))
+    )
+    if transaction_total is None:
         db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return jsonify({'success': False, 'error': 'Транзакция недоступна'}), 400
+    
+    defer_cart_commit_flush()
+    db.session.commit()
+    
+    return jsonify({
+        'success': True,
+        'transaction_total': float(transaction_total)
+    })
 
 @pos_bp.route('/api/transaction/apply_discount', methods=['POST'])
 def apply_discount():
     """Apply discount to current transaction"""
-    try:
-        data = request.get_json() or {}
-        transaction_id = session.get('current_transaction_id')
+    data = request.get_json() or {}
+    transaction_id = session.get('current_transaction_id')
+    
+    if not transaction_id:
+        return jsonify({'success': False, 'error': 'Нет активной транзакции'}), 400
+    
+    discount_type = data.get('type', 'percentage')  # percentage or fixed_amount
+    discount_value = Decimal(str(data.get('value', 0)))
+    
+    subtotal = func.coalesce(Transaction.subtotal, 0)
+    if discount_type == 'percentage':
+        discount_amount = subtotal * (discount_value / 100)
+    else:
+        discount_amount = literal(discount_value, db.Numeric(10, 2))
+    
+    # Ensure discount doesn't exceed subtotal
+    discount_amount = case((discount_amount > subtotal, subtotal), else_=discount_amount)
+    
+    # Discount and totals are set by one UPDATE on the pending transaction, no SELECT first
+    tax_amount = subtotal * VAT_RATE
+    result = db.session.execute(
+        update(Transaction)
+        .where(Transaction.id == transaction_id, Transaction.status == TransactionStatus.PENDING)
+        .values(
+            discount_amount=discount_amount,
+            tax_amount=tax_amount,
+            total_amount=subtotal + tax_amount - discount_amount
+        )
+        .returning(Transaction.discount_amount, Transaction.total_amount)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if not result:
+        return jsonify({'success': False, 'error': 'Транзакция не найдена'}), 400
+    
+    db.session.commit()
+    
+    return jsonify({
+        'success': True,
+        'discount_amount': float(result.discount_amount),
+        'total_amount': float(result.total_amount),
+        'message': f'Скидка {float(discount_value)}{"%" if discount_type == "percentage" else " ₽"} применена'
+    })
+
+@pos_bp.route('/api/transaction/apply_promo', methods=['POST'])
+def apply_promo_to_transaction():
+    """Apply promo code to current transaction with proper atomicity"""
+    # Check if promo features are enabled
+    if not current_app.config.get('PROMO_FEATURES_ENABLED', False):
+        return jsonify({'success': False, 'error': 'Promo code features not available - database schema incompatible'}), 503
+        
+    if not current_app.config.get('PROMO_CODES_TABLE_EXISTS', False):
+        return jsonify({'success': False, 'error': 'Promo codes table not available'}), 503
+        
+    data = request.get_json() or {}
+    code = PromoCode.normalize_code(data.get('code'))
+    transaction_id = session.get('current_transaction_id')
+    
+    if not transaction_id:
+        return jsonify({'success': False, 'error': 'Нет активной транзакции'}), 400
+    
+    if not code:
+        return jsonify({'success': False, 'error': 'Промокод не указан'}), 400
+        
+    # Use transaction for atomicity
+    with db.session.begin():
+        # Get and lock the transaction
+        transaction = db.session.query(Transaction).filter_by(id=transaction_id).with_for_update().first()
+        if not transaction or transaction.status != TransactionStatus.PENDING:
+            return jsonify({'success': False, 'error': 'Транзакция недоступна'}), 400
         
-        if not transaction_id:
-            return jsonify({'success': False, 'error': 'Нет активной транзакции'}), 400
+        # Check if promo already applied
+        if transaction.promo_code_used:
+            return jsonify({'success': False, 'error': 'Промокод уже применен к этой транзакции'}), 400
         
-        transaction = Transaction.query.get(transaction_id)
-        if not transaction:
-            return jsonify({'success': False, 'error': 'Транзакция не найдена'}), 400
+        # Plain read: usage is only counted on checkout by a conditional UPDATE.
+        # Dates and usage limit are checked in the query; the reason is looked up only on a miss
+        now = datetime.utcnow()
+        promo = find_usable_promo_code(code, now)
         
-        discount_type = data.get('type', 'percentage')  # percentage or fixed_amount
-        discount_value = float(data.get('value', 0))
+        if not promo:
+            error, status = promo_code_rejection(code, now)
+            return jsonify({'success': False, 'error': error}), status
         
-        if discount_type == 'percentage':
-            discount_amount = transaction.subtotal * (discount_value / 100)
+        if transaction.subtotal < promo.min_amount:
+            return jsonify({
+                'success': False, 
+                'error': f'Минимальная сумма для применения промокода: {float(promo.min_amount)} ₸'
+            }), 400
+        
+        # Calculate discount
+        if promo.discount_type == 'percentage':
+            discount_amount = transaction.subtotal * (promo.discount_value / 100)
         else:
-            discount_amount = discount_value
+            discount_amount = promo.discount_value
         
         # Ensure discount doesn't exceed subtotal
         discount_amount = min(discount_amount, transaction.subtotal)
         
+        # Apply discount to transaction
         transaction.discount_amount = discount_amount
-        update_transaction_totals(transaction)
+        transaction.promo_code_used = code
+        apply_subtotal_change(transaction, ZERO_AMOUNT)
         
-        db.session.commit()
+        # Note: Don't increment usage here - only on successful checkout
         
         return jsonify({
             'success': True,
+            'promo_code': code,
             'discount_amount': float(discount_amount),
             'total_amount': float(transaction.total_amount),
-            'message': f'Скидка {discount_value}{"%" if discount_type == "percentage" else " ₽"} применена'
+            'message': f'Промокод "{code}" применен! Скидка: {float(promo.discount_value)}{"%" if promo.discount_type == "percentage" else " ₸"}'
         })
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 500
-
-@pos_bp.route('/api/transaction/apply_promo', methods=['POST'])
-def apply_promo_to_transaction():
-    """Apply promo code to current transaction with proper atomicity"""
-    # Check if promo features are enabled
-    if not current_app.config.get('PROMO_FEATURES_ENABLED', False):
-        return jsonify({'success': False, 'error': 'Promo code features not available - database schema incompatible'}), 503
-        
-    if not current_app.config.get('PROMO_CODES_TABLE_EXISTS', False):
-        return jsonify({'success': False, 'error': 'Promo codes table not available'}), 503
-        
-    try:
-        data = request.get_json() or {}
-        code = data.get('code', '').upper().strip()
-        transaction_id = session.get('current_transaction_id')
-        
-        if not transaction_id:
-            return jsonify({'success': False, 'error': 'Нет активной транзакции'}), 400
-        
-        if not code:
-            return jsonify({'success': False, 'error': 'Промокод не указан'}), 400
-            
-        # Use transaction for atomicity
-        with db.session.begin():
-            # Get and lock the transaction
-            transaction = db.session.query(Transaction).filter_by(id=transaction_id).with_for_update().first()
-            if not transaction or transaction.status != TransactionStatus.PENDING:
-                return jsonify({'success': False, 'error': 'Транзакция недоступна'}), 400
-            
-            # Check if promo already applied
-            if transaction.promo_code_used:
-                return jsonify({'success': False, 'error': 'Промокод уже применен к этой транзакции'}), 400
-            
-            # Get and lock the promo code
-            promo = db.session.query(PromoCode).filter(
-                func.upper(PromoCode.code) == code,
-                PromoCode.is_active == True
-            ).with_for_update().first()
-            
-            if not promo:
-                return jsonify({'success': False, 'error': 'Промокод не найден или не активен'}), 404
-            
-            now = datetime.utcnow()
-            
-            # Validate promo code constraints
-            if promo.start_date and promo.start_date > now:
-                return jsonify({'success': False, 'error': 'Промокод еще не активен'}), 400
-            
-            if promo.end_date and promo.end_date < now:
-                return jsonify({'success': False, 'error': 'Промокод истек'}), 400
-            
-            if promo.max_uses and promo.current_uses >= promo.max_uses:
-                return jsonify({'success': False, 'error': 'Промокод исчерпан'}), 400
-            
-            if transaction.subtotal < promo.min_amount:
-                return jsonify({
-                    'success': False, 
-                    'error': f'Минимальная сумма для применения промокода: {float(promo.min_amount)} ₸'
-                }), 400
-            
-            # Calculate discount
-            if promo.discount_type == 'percentage':
-                discount_amount = transaction.subtotal * (promo.discount_value / 100)
-            else:
-                discount_amount = promo.discount_value
-            
-            # Ensure discount doesn't exceed subtotal
-            discount_amount = min(discount_amount, transaction.subtotal)
-            
-            # Apply discount to transaction
-            transaction.discount_amount = discount_amount
-            transaction.promo_code_used = code
-            update_transaction_totals(transaction)
-            
-            # Note: Don't increment usage here - only on successful checkout
-            
-            return jsonify({
-                'success': True,
-                'promo_code': code,
-                'discount_amount': float(discount_amount),
-                'total_amount': float(transaction.total_amount),
-                'message': f'Промокод "{code}" применен! Скидка: {float(promo.discount_value)}{"%" if promo.discount_type == "percentage" else " ₸"}'
-            })
-        
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 500
 
 @pos_bp.route('/api/transaction/remove_promo', methods=['POST'])
 def remove_promo_from_transaction():
@@ -914,31 +973,26 @@ def remove_promo_from_transaction():
     if not current_app.config.get('PROMO_FEATURES_ENABLED', False):
         return jsonify({'success': False, 'error': 'Promo code features not available - database schema incompatible'}), 503
         
-    try:
-        transaction_id = session.get('current_transaction_id')
+    transaction_id = session.get('current_transaction_id')
+    
+    if not transaction_id:
+        return jsonify({'success': False, 'error': 'Нет активной транзакции'}), 400
         
-        if not transaction_id:
-            return jsonify({'success': False, 'error': 'Нет активной транзакции'}), 400
-            
-        with db.session.begin():
-            transaction = db.session.query(Transaction).filter_by(id=transaction_id).with_for_update().first()
-            if not transaction or transaction.status != TransactionStatus.PENDING:
-                return jsonify({'success': False, 'error': 'Транзакция недоступна'}), 400
-            
-            if not transaction.promo_code_used:
-                return jsonify({'success': False, 'error': 'Промокод не применен'}), 400
-            
-            # Remove discount
-            transaction.discount_amount = Decimal('0.00')
-            transaction.promo_code_used = None
-            update_transaction_totals(transaction)
-            
-            return jsonify({
-                'success': True,
-                'total_amount': float(transaction.total_amount),
-                'message': 'Промокод удален'
-            })
+    with db.session.begin():
+        transaction = db.session.query(Transaction).filter_by(id=transaction_id).with_for_update().first()
+        if not transaction or transaction.status != TransactionStatus.PENDING:
+            return jsonify({'success': False, 'error': 'Транзакция недоступна'}), 400
         
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'success': False, 'error': str(e)}), 500
\ No newline at end of file
+        if not transaction.promo_code_used:
+            return jsonify({'success': False, 'error': 'Промокод не применен'}), 400
+        
+        # Remove discount
+        transaction.discount_amount = ZERO_AMOUNT
+        transaction.promo_code_used = None
+        apply_subtotal_change(transaction, ZERO_AMOUNT)
+        
+        return jsonify({
+            'success': True,
+            'total_amount': float(transaction.total_amount),
+            'message': 'Промокод удален'
+        })
\ No newline at end of file
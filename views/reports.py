@@ -1,180 +1,119 @@
 from flask import Blueprint, render_template, request, jsonify, send_file, session, flash, redirect, url_for
 from flask_login import login_required, current_user
-from models import db, Product, Supplier, Category, Transaction, TransactionItem, Payment, User
+from models import db, Product, Supplier, Category, Transaction, TransactionItem, Payment, User, DailySales, ProductDailySales
 from models import PaymentMethod, TransactionStatus, UnitType, UserRole
 from utils.helpers import require_role
-from datetime import datetime, timedelta
-from sqlalchemy import desc, func
+from services.cache_service import cache_service
+from datetime import date, datetime, timedelta
+from sqlalchemy import desc, func, case, cast, select, bindparam, literal, or_, union_all, String
 import io
-import pandas as pd
+from openpyxl import Workbook
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib import colors
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, Table, LongTable, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 
 reports_bp = Blueprint('reports', __name__)
 
-
-@reports_bp.route('/reports')
-@login_required
-def reports():
-    """Enhanced reports and analytics page"""
-    # Date range filter
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    report_type = request.args.get('type', 'overview')  # overview, profit, categories, inventory
+def build_sales_breakdown_statement():
+    """Daily, top product and category aggregates for a period as one UNION ALL.
     
-    if not start_date:
-        start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-    if not end_date:
-        end_date = datetime.now().strftime('%Y-%m-%d')
-    
-    # Sales by day with profit calculation
-    daily_sales = db.session.query(
-        func.date(Transaction.created_at).label('date'),
-        func.sum(Transaction.total_amount).label('total_revenue'),
-        func.sum(
-            TransactionItem.quantity * (Product.price - Product.cost_price)
-        ).label('total_profit')
-    ).select_from(Transaction).join(
-        TransactionItem, Transaction.id == TransactionItem.transaction_id
-    ).join(
-        Product, TransactionItem.product_id == Product.id
-    ).filter(
-        Transaction.status == TransactionStatus.COMPLETED,
-        func.date(Transaction.created_at) >= start_date,
-        func.date(Transaction.created_at) <= end_date
-    ).group_by(func.date(Transaction.created_at)).all()
-    
-    # Monthly aggregation for longer periods (database-agnostic using extract)
-    monthly_sales = db.session.query(
-        func.concat(
-            func.extract('year', Transaction.created_at), 
-            '-', 
-            func.lpad(func.extract('month', Transaction.created_at).cast(db.String), 2, '0')
-        ).label('month'),
-        func.sum(Transaction.total_amount).label('total_revenue'),
-        func.sum(
-            TransactionItem.quantity * (Product.price - Product.cost_price)
-        ).label('total_profit')
+    All three read the same period_items CTE, so the transaction/item/product
+    join is written once and the rows come back in a single round trip,
+    tagged by their 'kind' column.
+    """
+    period_items = select(
+        # The transaction total is carried on its first item row only, so summing it
+        # over item rows counts each sale once, as get_reports_totals does
+        case(
+            (func.row_number().over(
+                partition_by=Transaction.id, order_by=TransactionItem.id
+            ) == 1, Transaction.total_amount),
+            else_=0
+        ).label('transaction_revenue'),
+        cast(func.date(Transaction.created_at), String).label('day'),
+        TransactionItem.id.label('item_id'),
+        TransactionItem.quantity,
+        TransactionItem.total_price,
+        TransactionItem.line_profit,
+        (TransactionItem.unit_price - TransactionItem.unit_cost).label('unit_profit'),
+        Product.id.label('product_id'),
+        Product.name.label('product_name'),
+        Product.category_id
     ).select_from(Transaction).join(
         TransactionItem, Transaction.id == TransactionItem.transaction_id
     ).join(
         Product, TransactionItem.product_id == Product.id
-    ).filter(
-        Transaction.status == TransactionStatus.COMPLETED,
-        func.date(Transaction.created_at) >= start_date,
-        func.date(Transaction.created_at) <= end_date
-    ).group_by(
-        func.extract('year', Transaction.created_at),
-        func.extract('month', Transaction.created_at)
-    ).all()
+    ).where(
+        Transaction.status == bindparam('status'),
+        Transaction.created_at >= bindparam('period_start'),
+        Transaction.created_at < bindparam('period_end')
+    ).cte('period_items')
     
-    # Top selling products with profit
-    top_products = db.session.query(
-        Product.name,
-        func.sum(TransactionItem.quantity).label('total_sold'),
-        func.sum(TransactionItem.total_price).label('total_revenue'),
-        func.sum(
-            TransactionItem.quantity * (Product.price - Product.cost_price)
-        ).label('total_profit'),
-        func.avg(Product.price - Product.cost_price).label('avg_profit_per_unit')
-    ).select_from(Product).join(
-        TransactionItem, Product.id == TransactionItem.product_id
-    ).join(
-        Transaction, TransactionItem.transaction_id == Transaction.id
-    ).filter(
-        Transaction.status == TransactionStatus.COMPLETED,
-        func.date(Transaction.created_at) >= start_date,
-        func.date(Transaction.created_at) <= end_date
-    ).group_by(Product.id, Product.name).order_by(desc('total_sold')).limit(10).all()
-    
-    # Category analysis - most popular categories
-    category_analysis = db.session.query(
-        Category.name,
-        func.count(TransactionItem.id).label('total_transactions'),
-        func.sum(TransactionItem.quantity).label('total_sold'),
-        func.sum(TransactionItem.total_price).label('total_revenue'),
-        func.sum(
-            TransactionItem.quantity * (Product.price - Product.cost_price)
-        ).label('total_profit')
-    ).select_from(Category).join(
-        Product, Category.id == Product.category_id
-    ).join(
-        TransactionItem, Product.id == TransactionItem.product_id
-    ).join(
-        Transaction, TransactionItem.transaction_id == Transaction.id
-    ).filter(
-        Transaction.status == TransactionStatus.COMPLETED,
-        func.date(Transaction.created_at) >= start_date,
-        func.date(Transaction.created_at) <= end_date
-    ).group_by(Category.id, Category.name).order_by(desc('total_revenue')).all()
+    def aggregates(revenue):
+        return (
+            func.count(period_items.c.item_id).label('total_transactions'),
+            func.sum(period_items.c.quantity).label('total_sold'),
+            func.sum(revenue).label('total_revenue'),
+            func.sum(period_items.c.line_profit).label('total_profit'),
+            func.avg(period_items.c.unit_profit).label('avg_profit_per_unit')
+        )
     
-    # Inventory analysis
-    inventory_report = db.session.query(
-        Product.name,
-        Product.sku,
-        Product.stock_quantity,
-        Product.min_stock_level,
-        Product.price,
-        Product.cost_price,
-        Category.name.label('category_name'),
-        Supplier.name.label('supplier_name')
-    ).select_from(Product).join(
-        Category, Product.category_id == Category.id
-    ).join(
-        Supplier, Product.supplier_id == Supplier.id
-    ).filter(
-        Product.is_active == True
-    ).order_by(Product.stock_quantity.asc()).all()
+    daily = select(
+        literal('daily').label('kind'),
+        period_items.c.day.label('name'),
+        *aggregates(period_items.c.transaction_revenue)
+    ).group_by(period_items.c.day)
     
-    # Convert Row objects to dictionaries for JSON serialization
-    daily_sales = [{
-        'date': str(row.date),
-        'total_revenue': float(row.total_revenue or 0),
-        'total_profit': float(row.total_profit or 0)
-    } for row in daily_sales]
+    top_products = select(
+        literal('product').label('kind'),
+        period_items.c.product_name.label('name'),
+        *aggregates(period_items.c.total_price)
+    ).group_by(
+        period_items.c.product_id, period_items.c.product_name
+    ).order_by(desc('total_sold')).limit(10).subquery()
     
-    monthly_sales = [{
-        'month': str(row.month),
-        'total_revenue': float(row.total_revenue or 0),
-        'total_profit': float(row.total_profit or 0)
-    } for row in monthly_sales]
+    categories = select(
+        literal('category').label('kind'),
+        Category.name.label('name'),
+        *aggregates(period_items.c.total_price)
+    ).select_from(period_items).join(
+        Category, Category.id == period_items.c.category_id
+    ).group_by(Category.id, Category.name)
     
-    top_products = [{
-        'name': row.name,
-        'total_sold': float(row.total_sold or 0),
-        'total_revenue': float(row.total_revenue or 0),
-        'total_profit': float(row.total_profit or 0),
-        'avg_profit_per_unit': float(row.avg_profit_per_unit or 0)
-    } for row in top_products]
+    return union_all(daily, select(*top_products.c), categories)
+
+
+# Built once at import time with bind parameters so the compiled form is
+# reused from SQLAlchemy's statement cache
+SALES_BREAKDOWN_STATEMENT = build_sales_breakdown_statement()
+
+
+@reports_bp.route('/reports')
+@login_required
+def reports():
+    """Enhanced reports and analytics page"""
+    # Date range filter
+    start_date, end_date = get_report_date_range()
+    report_type = request.args.get('type', 'overview')  # overview, profit, categories, inventory
     
-    category_analysis = [{
-        'name': row.name,
-        'total_transactions': int(row.total_transactions or 0),
-        'total_sold': float(row.total_sold or 0),
-        'total_revenue': float(row.total_revenue or 0),
-        'total_profit': float(row.total_profit or 0)
-    } for row in category_analysis]
+    daily_sales, category_analysis, top_products, inventory_report = get_cached_reports_data(start_date, end_date)
     
-    inventory_report = [{
-        'name': row.name,
-        'sku': row.sku,
-        'stock_quantity': int(row.stock_quantity or 0),
-        'min_stock_level': int(row.min_stock_level or 0),
-        'price': float(row.price or 0),
-        'cost_price': float(row.cost_price or 0),
-        'category_name': row.category_name,
-        'supplier_name': row.supplier_name
-    } for row in inventory_report]
+    # Monthly aggregation is rolled up from the daily rows instead of scanning the sales again
+    monthly_totals = {}
+    for sale in daily_sales:
+        month = sale['date'][:7]
+        totals = monthly_totals.setdefault(month, {'month': month, 'total_revenue': 0.0, 'total_profit': 0.0})
+        totals['total_revenue'] += sale['total_revenue']
+        totals['total_profit'] += sale['total_profit']
+    monthly_sales = [monthly_totals[month] for month in sorted(monthly_totals)]
     
     # Low stock items
     low_stock_items = [item for item in inventory_report if item['stock_quantity'] <= item['min_stock_level']]
     
     # Calculate key metrics
-    total_revenue = sum(sale['total_revenue'] or 0 for sale in daily_sales)
-    total_profit = sum(sale['total_profit'] or 0 for sale in daily_sales)
+    total_revenue, total_profit = get_reports_totals(start_date, end_date)
     profit_margin = (total_profit / total_revenue * 100) if total_revenue > 0 else 0
     
     return render_template('reports.html',
@@ -195,215 +134,198 @@ def reports():
 @login_required
 def export_pdf():
     """Export reports as PDF"""
-    try:
-        # Get the same data as reports route
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        
-        if not start_date:
-            start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-        if not end_date:
-            end_date = datetime.now().strftime('%Y-%m-%d')
-        
-        # Get analytics data
-        daily_sales, category_analysis, top_products, inventory_report = get_reports_data(start_date, end_date)
-        
-        # Create PDF
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4)
-        styles = getSampleStyleSheet()
-        story = []
+    # Get the same data as reports route
+    start_date, end_date = get_report_date_range()
+    
+    # Get analytics data
+    daily_sales, category_analysis, top_products, inventory_report = get_cached_reports_data(start_date, end_date)
+    
+    # Create PDF
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4)
+    styles = getSampleStyleSheet()
+    story = []
+    
+    # Title
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=18,
+        spaceAfter=30,
+        alignment=1  # Center
+    )
+    story.append(Paragraph(f'POS System Analytics Report', title_style))
+    story.append(Paragraph(f'Period: {start_date} to {end_date}', styles['Normal']))
+    story.append(Spacer(1, 20))
+    
+    # Daily Sales Table
+    if daily_sales:
+        story.append(Paragraph('Daily Sales and Profit', styles['Heading2']))
+        sales_data = [['Date', 'Revenue (₸)', 'Profit (₸)']]
+        for sale in daily_sales:
+            sales_data.append([
+                str(sale['date']),
+                f"{sale['total_revenue'] or 0:.2f}",
+                f"{sale['total_profit'] or 0:.2f}"
+            ])
         
-        # Title
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=18,
-            spaceAfter=30,
-            alignment=1  # Center
-        )
-        story.append(Paragraph(f'POS System Analytics Report', title_style))
-        story.append(Paragraph(f'Period: {start_date} to {end_date}', styles['Normal']))
+        # One row per day, so long periods span pages: LongTable lays them out
+        # faster and the header row is repeated on every page
+        sales_table = LongTable(sales_data, repeatRows=1)
+        sales_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 14),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]))
+        story.append(sales_table)
         story.append(Spacer(1, 20))
+    
+    # Top Products Table
+    if top_products:
+        story.append(Paragraph('Top Selling Products', styles['Heading2']))
+        products_data = [['Product', 'Sold', 'Revenue (₸)', 'Profit (₸)']]
+        for product in top_products:
+            products_data.append([
+                product['name'],
+                f"{product['total_sold']:.0f}",
+                f"{product['total_revenue']:.2f}",
+                f"{product['total_profit'] or 0:.2f}"
+            ])
         
-        # Daily Sales Table
-        if daily_sales:
-            story.append(Paragraph('Daily Sales and Profit', styles['Heading2']))
-            sales_data = [['Date', 'Revenue (₸)', 'Profit (₸)']]
-            for sale in daily_sales:
-                sales_data.append([
-                    str(sale['date']),
-                    f"{sale['total_revenue'] or 0:.2f}",
-                    f"{sale['total_profit'] or 0:.2f}"
-                ])
-            
-            sales_table = Table(sales_data)
-            sales_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 14),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            story.append(sales_table)
-            story.append(Spacer(1, 20))
-        
-        # Top Products Table
-        if top_products:
-            story.append(Paragraph('Top Selling Products', styles['Heading2']))
-            products_data = [['Product', 'Sold', 'Revenue (₸)', 'Profit (₸)']]
-            for product in top_products:
-                products_data.append([
-                    product['name'],
-                    f"{product['total_sold']:.0f}",
-                    f"{product['total_revenue']:.2f}",
-                    f"{product['total_profit'] or 0:.2f}"
-                ])
-            
-            products_table = Table(products_data)
-            products_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            story.append(products_table)
-            story.append(Spacer(1, 20))
-        
-        # Category Analysis Table
-        if category_analysis:
-            story.append(Paragraph('Category Analysis', styles['Heading2']))
-            category_data = [['Category', 'Transactions', 'Revenue (₸)', 'Profit (₸)']]
-            for category in category_analysis:
-                category_data.append([
-                    category['name'],
-                    str(category['total_transactions']),
-                    f"{category['total_revenue']:.2f}",
-                    f"{category['total_profit'] or 0:.2f}"
-                ])
-            
-            category_table = Table(category_data)
-            category_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            story.append(category_table)
-        
-        # Build PDF
-        doc.build(story)
-        buffer.seek(0)
-        
-        return send_file(
-            buffer,
-            as_attachment=True,
-            download_name=f'pos_report_{start_date}_{end_date}.pdf',
-            mimetype='application/pdf'
-        )
+        products_table = Table(products_data)
+        products_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 12),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]))
+        story.append(products_table)
+        story.append(Spacer(1, 20))
+    
+    # Category Analysis Table
+    if category_analysis:
+        story.append(Paragraph('Category Analysis', styles['Heading2']))
+        category_data = [['Category', 'Transactions', 'Revenue (₸)', 'Profit (₸)']]
+        for category in category_analysis:
+            category_data.append([
+                category['name'],
+                str(category['total_transactions']),
+                f"{category['total_revenue']:.2f}",
+                f"{category['total_profit'] or 0:.2f}"
+            ])
         
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        category_table = Table(category_data)
+        category_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 12),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]))
+        story.append(category_table)
+    
+    # Build PDF
+    doc.build(story)
+    buffer.seek(0)
+    
+    return send_file(
+        buffer,
+        as_attachment=True,
+        download_name=f'pos_report_{start_date}_{end_date}.pdf',
+        mimetype='application/pdf'
+    )
 
 @reports_bp.route('/export/excel', methods=['POST'])
 @login_required
 def export_excel():
     """Export reports as Excel"""
-    try:
-        # Get the same data as reports route
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        
-        if not start_date:
-            start_date = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-        if not end_date:
-            end_date = datetime.now().strftime('%Y-%m-%d')
-        
-        # Get analytics data
-        daily_sales, category_analysis, top_products, inventory_report = get_reports_data(start_date, end_date)
-        
-        # Create Excel file
-        buffer = io.BytesIO()
-        
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            # Daily Sales Sheet
-            if daily_sales:
-                sales_df = pd.DataFrame([
-                    {
-                        'Date': sale['date'],
-                        'Revenue (₸)': sale['total_revenue'] or 0,
-                        'Profit (₸)': sale['total_profit'] or 0
-                    } for sale in daily_sales
-                ])
-                sales_df.to_excel(writer, sheet_name='Daily Sales', index=False)
-            
-            # Top Products Sheet
-            if top_products:
-                products_df = pd.DataFrame([
-                    {
-                        'Product': product['name'],
-                        'Quantity Sold': product['total_sold'],
-                        'Revenue (₸)': product['total_revenue'],
-                        'Profit (₸)': product['total_profit'] or 0,
-                        'Avg Profit per Unit (₸)': product['avg_profit_per_unit'] or 0
-                    } for product in top_products
-                ])
-                products_df.to_excel(writer, sheet_name='Top Products', index=False)
-            
-            # Category Analysis Sheet
-            if category_analysis:
-                categories_df = pd.DataFrame([
-                    {
-                        'Category': category['name'],
-                        'Total Transactions': category['total_transactions'],
-                        'Total Sold': category['total_sold'],
-                        'Revenue (₸)': category['total_revenue'],
-                        'Profit (₸)': category['total_profit'] or 0,
-                        'Profit Margin (%)': (category['total_profit'] / category['total_revenue'] * 100) if category['total_revenue'] > 0 else 0
-                    } for category in category_analysis
-                ])
-                categories_df.to_excel(writer, sheet_name='Category Analysis', index=False)
-            
-            # Inventory Report Sheet
-            if inventory_report:
-                inventory_df = pd.DataFrame([
-                    {
-                        'Product': item['name'],
-                        'SKU': item['sku'],
-                        'Stock Quantity': item['stock_quantity'],
-                        'Min Stock Level': item['min_stock_level'],
-                        'Price (₸)': item['price'],
-                        'Cost Price (₸)': item['cost_price'],
-                        'Profit per Unit (₸)': item['price'] - item['cost_price'],
-                        'Category': item['category_name'],
-                        'Supplier': item['supplier_name'],
-                        'Status': 'Low Stock' if item['stock_quantity'] <= item['min_stock_level'] else 'OK'
-                    } for item in inventory_report
-                ])
-                inventory_df.to_excel(writer, sheet_name='Inventory Report', index=False)
-        
-        buffer.seek(0)
-        
-        return send_file(
-            buffer,
-            as_attachment=True,
-            download_name=f'pos_report_{start_date}_{end_date}.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    # Get the same data as reports route
+    start_date, end_date = get_report_date_range()
+    
+    # Get analytics data
+    daily_sales, category_analysis, top_products, inventory_report = get_cached_reports_data(start_date, end_date)
+    
+    # Create Excel file; rows go straight into a write-only workbook, which
+    # serializes them as they are appended instead of keeping cell objects
+    buffer = io.BytesIO()
+    workbook = Workbook(write_only=True)
+    
+    # Daily Sales Sheet
+    if daily_sales:
+        sheet = workbook.create_sheet('Daily Sales')
+        sheet.append(['Date', 'Revenue (₸)', 'Profit (₸)'])
+        for sale in daily_sales:
+            sheet.append([sale['date'], sale['total_revenue'] or 0, sale['total_profit'] or 0])
+    
+    # Top Products Sheet
+    if top_products:
+        sheet = workbook.create_sheet('Top Products')
+        sheet.append(['Product', 'Quantity Sold', 'Revenue (₸)', 'Profit (₸)', 'Avg Profit per Unit (₸)'])
+        for product in top_products:
+            sheet.append([
+                product['name'],
+                product['total_sold'],
+                product['total_revenue'],
+                product['total_profit'] or 0,
+                product['avg_profit_per_unit'] or 0
+            ])
+    
+    # Category Analysis Sheet
+    if category_analysis:
+        sheet = workbook.create_sheet('Category Analysis')
+        sheet.append(['Category', 'Total Transactions', 'Total Sold', 'Revenue (₸)', 'Profit (₸)', 'Profit Margin (%)'])
+        for category in category_analysis:
+            sheet.append([
+                category['name'],
+                category['total_transactions'],
+                category['total_sold'],
+                category['total_revenue'],
+                category['total_profit'] or 0,
+                (category['total_profit'] / category['total_revenue'] * 100) if category['total_revenue'] > 0 else 0
+            ])
+    
+    # Inventory Report Sheet
+    if inventory_report:
+        sheet = workbook.create_sheet('Inventory Report')
+        sheet.append([
+            'Product', 'SKU', 'Stock Quantity', 'Min Stock Level', 'Price (₸)', 'Cost Price (₸)',
+            'Profit per Unit (₸)', 'Category', 'Supplier', 'Status'
+        ])
+        for item in inventory_report:
+            sheet.append([
+                item['name'],
+                item['sku'],
+                item['stock_quantity'],
+                item['min_stock_level'],
+                item['price'],
+                item['cost_price'],
+                item['price'] - item['cost_price'],
+                item['category_name'],
+                item['supplier_name'],
+                'Low Stock' if item['stock_quantity'] <= item['min_stock_level'] else 'OK'
+            ])
+    
+    workbook.save(buffer)
+    buffer.seek(0)
+    
+    return send_file(
+        buffer,
+        as_attachment=True,
+        download_name=f'pos_report_{start_date}_{end_date}.xlsx',
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
 
 @reports_bp.route('/api/analytics/top_products')
 @login_required
@@ -412,30 +334,8 @@ def get_top_products():
     days = request.args.get('days', 30, type=int)
     start_date = datetime.utcnow() - timedelta(days=days)
     
-    # Top products by quantity
-    top_by_quantity = db.session.query(
-        Product.name,
-        Product.sku,
-        func.sum(TransactionItem.quantity).label('total_sold'),
-        func.sum(TransactionItem.total_price).label('total_revenue'),
-        func.count(TransactionItem.id).label('transaction_count')
-    ).join(TransactionItem).join(Transaction).filter(
-        Transaction.status == TransactionStatus.COMPLETED,
-        Transaction.created_at >= start_date
-    ).group_by(Product.id, Product.name, Product.sku)\
-     .order_by(desc('total_sold')).limit(10).all()
-    
-    # Low performing products
-    low_performing = db.session.query(
-        Product.name,
-        Product.sku,
-        func.sum(TransactionItem.quantity).label('total_sold'),
-        func.sum(TransactionItem.total_price).label('total_revenue')
-    ).join(TransactionItem).join(Transaction).filter(
-        Transaction.status == TransactionStatus.COMPLETED,
-        Transaction.created_at >= start_date
-    ).group_by(Product.id, Product.name, Product.sku)\
-     .order_by('total_sold').limit(10).all()
+    # Top and low performing products by quantity in one pass over the sales
+    top_by_quantity, low_performing = get_product_sales_rankings(start_date)
     
     return jsonify({
         'top_products': [{
@@ -453,129 +353,168 @@ def get_top_products():
         } for p in low_performing]
     })
 
+def get_product_sales_rankings(start_date, limit=10):
+    """Best and worst selling products by quantity sold since start_date.
+    
+    Sales come from the product_daily_sales pre-aggregate and are ranked in
+    both directions with window functions; products are joined only for the
+    ranked rows. Plain Core selects: the rows are only read into dicts, so no ORM
+    query layer is involved. Returns (top, low) lists ordered by total_sold
+    descending / ascending.
+    """
+    total_sold = func.sum(ProductDailySales.quantity)
+    sales = select(
+        ProductDailySales.product_id,
+        total_sold.label('total_sold'),
+        func.sum(ProductDailySales.total_revenue).label('total_revenue'),
+        func.sum(ProductDailySales.item_count).label('transaction_count'),
+        func.row_number().over(order_by=(total_sold.desc(), ProductDailySales.product_id)).label('top_rank'),
+        func.row_number().over(order_by=(total_sold.asc(), ProductDailySales.product_id)).label('low_rank')
+    ).where(
+        ProductDailySales.date >= start_date.date()
+    ).group_by(ProductDailySales.product_id).subquery()
+    
+    rows = db.session.execute(select(
+        Product.name,
+        Product.sku,
+        sales.c.total_sold,
+        sales.c.total_revenue,
+        sales.c.transaction_count,
+        sales.c.top_rank,
+        sales.c.low_rank
+    ).join(
+        sales, Product.id == sales.c.product_id
+    ).where(
+        or_(sales.c.top_rank <= limit, sales.c.low_rank <= limit)
+    )).all()
+    
+    top = sorted((row for row in rows if row.top_rank <= limit), key=lambda row: row.top_rank)
+    low = sorted((row for row in rows if row.low_rank <= limit), key=lambda row: row.low_rank)
+    return top, low
+
 @reports_bp.route('/api/analytics/sales_summary')
 @login_required
 def get_sales_summary():
     """Get sales summary for dashboard"""
     today = datetime.utcnow().date()
-    start_of_month = today.replace(day=1)
     
-    # Today's sales
-    today_sales = db.session.query(
-        func.sum(Transaction.total_amount),
-        func.count(Transaction.id)
-    ).filter(
-        func.date(Transaction.created_at) == today,
-        Transaction.status == TransactionStatus.COMPLETED
-    ).first()
-    
-    # Month's sales
-    month_sales = db.session.query(
-        func.sum(Transaction.total_amount),
-        func.count(Transaction.id)
-    ).filter(
-        func.date(Transaction.created_at) >= start_of_month,
-        Transaction.status == TransactionStatus.COMPLETED
-    ).first()
+    # Кэшируем на 30 секунд, сбрасывается при завершении продажи
+    summary = cache_service.get_or_set(
+        f"sales_summary:{today}",
+        lambda: fetch_sales_summary(today),
+        ttl=30
+    )
+    return jsonify(summary)
+
+def fetch_sales_summary(today):
+    """Compute sales summary for the given day and its month"""
+    start_of_month = today.replace(day=1)
     
-    # Low stock alerts
-    low_stock_products = Product.query.filter(
+    # Today's and month's sales (from the daily_sales pre-aggregate) plus the low stock
+    # count in a single round trip, using conditional aggregation
+    is_today = DailySales.date == today
+    low_stock_count = db.session.query(func.count(Product.id)).filter(
         Product.stock_quantity <= Product.min_stock_level,
         Product.is_active == True
-    ).count()
+    ).scalar_subquery()
     
-    return jsonify({
+    summary = db.session.query(
+        func.sum(case((is_today, DailySales.total_revenue), else_=0)).label('today_revenue'),
+        func.sum(case((is_today, DailySales.transaction_count), else_=0)).label('today_transactions'),
+        func.sum(DailySales.total_revenue).label('month_revenue'),
+        func.sum(DailySales.transaction_count).label('month_transactions'),
+        low_stock_count.label('low_stock_count')
+    ).filter(
+        DailySales.date >= start_of_month
+    ).one()
+    
+    return {
         'today': {
-            'revenue': float(today_sales[0] if today_sales and today_sales[0] else 0),
-            'transactions': today_sales[1] if today_sales and today_sales[1] else 0
+            'revenue': float(summary.today_revenue or 0),
+            'transactions': int(summary.today_transactions or 0)
         },
         'month': {
-            'revenue': float(month_sales[0] if month_sales and month_sales[0] else 0),
-            'transactions': month_sales[1] if month_sales and month_sales[1] else 0
+            'revenue': float(summary.month_revenue or 0),
+            'transactions': int(summary.month_transactions or 0)
         },
-        'low_stock_count': low_stock_products
-    })
+        'low_stock_count': int(summary.low_stock_count or 0)
+    }
 
-def get_reports_data(start_date, end_date):
-    """Helper function to get reports data"""
-    # Sales by day with profit calculation
-    daily_sales = db.session.query(
-        func.date(Transaction.created_at).label('date'),
-        func.sum(Transaction.total_amount).label('total_revenue'),
-        func.sum(
-            TransactionItem.quantity * (Product.price - Product.cost_price)
-        ).label('total_profit')
-    ).select_from(Transaction).join(
-        TransactionItem, Transaction.id == TransactionItem.transaction_id
-    ).join(
-        Product, TransactionItem.product_id == Product.id
-    ).filter(
-        Transaction.status == TransactionStatus.COMPLETED,
-        func.date(Transaction.created_at) >= start_date,
-        func.date(Transaction.created_at) <= end_date
-    ).group_by(func.date(Transaction.created_at)).all()
+def get_period_bounds(start_date, end_date):
+    """Convert inclusive 'YYYY-MM-DD' dates into a half-open datetime range.
     
-    # Top selling products with profit
-    top_products = db.session.query(
-        Product.name,
-        func.sum(TransactionItem.quantity).label('total_sold'),
-        func.sum(TransactionItem.total_price).label('total_revenue'),
-        func.sum(
-            TransactionItem.quantity * (Product.price - Product.cost_price)
-        ).label('total_profit'),
-        func.avg(Product.price - Product.cost_price).label('avg_profit_per_unit')
-    ).select_from(Product).join(
-        TransactionItem, Product.id == TransactionItem.product_id
-    ).join(
-        Transaction, TransactionItem.transaction_id == Transaction.id
-    ).filter(
+    Comparing created_at directly (instead of func.date(created_at)) keeps
+    the filter index-friendly.
+    """
+    period_start = datetime.strptime(start_date, '%Y-%m-%d')
+    period_end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+    return period_start, period_end
+
+def get_report_date_range():
+    """Read the report date range from the query string as whole 'YYYY-MM-DD' days
+    
+    Dates are re-formatted after parsing, so equivalent ranges share one
+    reports cache entry; the default range is the last seven days.
+    """
+    today = date.today()
+    start_date = request.args.get('start_date') or (today - timedelta(days=7)).isoformat()
+    end_date = request.args.get('end_date') or today.isoformat()
+    return (
+        datetime.strptime(start_date, '%Y-%m-%d').date().isoformat(),
+        datetime.strptime(end_date, '%Y-%m-%d').date().isoformat()
+    )
+
+def get_cached_reports_data(start_date, end_date):
+    """Reports data for a date range, shared by the reports page and both exports"""
+    # Кэшируем на 60 секунд, сбрасывается при завершении продажи и изменении товаров
+    return cache_service.get_or_set(
+        f"reports_data:{start_date}:{end_date}",
+        lambda: list(get_reports_data(start_date, end_date)),
+        ttl=60
+    )
+
+def get_reports_totals(start_date, end_date):
+    """Total revenue and profit for the period, summed by the database"""
+    period_start, period_end = get_period_bounds(start_date, end_date)
+    in_period = (
         Transaction.status == TransactionStatus.COMPLETED,
-        func.date(Transaction.created_at) >= start_date,
-        func.date(Transaction.created_at) <= end_date
-    ).group_by(Product.id, Product.name).order_by(desc('total_sold')).limit(10).all()
-    
-    # Category analysis - most popular categories
-    category_analysis = db.session.query(
-        Category.name,
-        func.count(TransactionItem.id).label('total_transactions'),
-        func.sum(TransactionItem.quantity).label('total_sold'),
-        func.sum(TransactionItem.total_price).label('total_revenue'),
-        func.sum(
-            TransactionItem.quantity * (Product.price - Product.cost_price)
-        ).label('total_profit')
-    ).select_from(Category).join(
-        Product, Category.id == Product.category_id
-    ).join(
-        TransactionItem, Product.id == TransactionItem.product_id
-    ).join(
+        Transaction.created_at >= period_start,
+        Transaction.created_at < period_end
+    )
+    
+    # Revenue is summed per transaction, profit per line, so neither repeats the other's rows
+    total_revenue = select(func.sum(Transaction.total_amount)).where(*in_period).scalar_subquery()
+    total_profit = select(func.sum(TransactionItem.line_profit)).join(
         Transaction, TransactionItem.transaction_id == Transaction.id
-    ).filter(
-        Transaction.status == TransactionStatus.COMPLETED,
-        func.date(Transaction.created_at) >= start_date,
-        func.date(Transaction.created_at) <= end_date
-    ).group_by(Category.id, Category.name).order_by(desc('total_revenue')).all()
+    ).where(*in_period).scalar_subquery()
     
-    # Inventory analysis
-    inventory_report = db.session.query(
-        Product.name,
-        Product.sku,
-        Product.stock_quantity,
-        Product.min_stock_level,
-        Product.price,
-        Product.cost_price,
-        Category.name.label('category_name'),
-        Supplier.name.label('supplier_name')
-    ).select_from(Product).join(
-        Category, Product.category_id == Category.id
-    ).join(
-        Supplier, Product.supplier_id == Supplier.id
-    ).filter(
-        Product.is_active == True
-    ).order_by(Product.stock_quantity.asc()).all()
+    totals = db.session.execute(select(total_revenue, total_profit)).one()
+    return float(totals[0] or 0), float(totals[1] or 0)
+
+def get_reports_data(start_date, end_date):
+    """Helper function to get reports data
+    
+    The aggregates run as Core selects; their rows go straight into dicts.
+    """
+    period_start, period_end = get_period_bounds(start_date, end_date)
+    
+    # Daily sales, top products and categories come back together, tagged by kind
+    breakdown = {'daily': [], 'product': [], 'category': []}
+    for row in db.session.execute(SALES_BREAKDOWN_STATEMENT, {
+        'status': TransactionStatus.COMPLETED,
+        'period_start': period_start,
+        'period_end': period_end
+    }):
+        breakdown[row.kind].append(row)
+    
+    # UNION ALL keeps no order across branches, so each part is sorted here
+    daily_sales = sorted(breakdown['daily'], key=lambda row: row.name)
+    top_products = sorted(breakdown['product'], key=lambda row: row.total_sold, reverse=True)
+    category_analysis = sorted(breakdown['category'], key=lambda row: row.total_revenue or 0, reverse=True)
     
     # Convert Row objects to dictionaries for JSON serialization
     daily_sales_data = [{
-        'date': str(row.date),
+        'date': row.name,
         'total_revenue': float(row.total_revenue or 0),
         'total_profit': float(row.total_profit or 0)
     } for row in daily_sales]
@@ -596,6 +535,25 @@ def get_reports_data(start_date, end_date):
         'avg_profit_per_unit': float(row.avg_profit_per_unit or 0)
     } for row in top_products]
     
+    # Inventory analysis covers every active product, so its rows are fetched in
+    # batches and turned into dicts as they arrive instead of via a full .all() list
+    inventory_report = select(
+        Product.name,
+        Product.sku,
+        Product.stock_quantity,
+        Product.min_stock_level,
+        Product.price,
+        Product.cost_price,
+        Category.name.label('category_name'),
+        Supplier.name.label('supplier_name')
+    ).select_from(Product).join(
+        Category, Product.category_id == Category.id
+    ).join(
+        Supplier, Product.supplier_id == Supplier.id
+    ).where(
+        Product.is_active == True
+    ).order_by(Product.stock_quantity.asc()).execution_options(yield_per=1000)
+    
     inventory_report_data = [{
         'name': row.name,
         'sku': row.sku,
@@ -605,6 +563,6 @@ def get_reports_data(start_date, end_date):
         'cost_price': float(row.cost_price or 0),
         'category_name': row.category_name,
         'supplier_name': row.supplier_name
-    } for row in inventory_report]
+    } for row in db.session.execute(inventory_report)]
     
     return daily_sales_data, category_analysis_data, top_products_data, inventory_report_data
\ No newline at end of file